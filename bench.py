@@ -0,0 +1,734 @@
+"""
+Benchmarks for the chatbot against a local fake Gemini model (see fake_genai.py).
+No API key or network access needed; requires httpx (pip install httpx).
+
+Usage:
+    python bench.py                  # load test: /chat, /reset and / at 1, 8 and 32 concurrent guests
+    python bench.py --stream --tokens 40 --token-delay 0.02 --error-rate 0.05
+    python bench.py --max-p99-ms 500 --max-error-rate 0.01   # exit status 1 on regression
+    python bench.py --mode ttfb --latency 0.2 --tokens 40 --token-delay 0.02   # exit status 1 if streaming doesn't help
+    python bench.py --mode resilience                               # exit status 1 if retries, breaker or limits misbehave
+    python bench.py --mode overhead --turns 200
+    python bench.py --mode compaction --budget 1000
+    python bench.py --mode startup --runs 3
+    python bench.py --mode fastpath                                 # exit status 1 on a wrong local answer
+    python bench.py --mode sessions                                 # exit status 1 if a session backend misbehaves
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import httpx
+import uvicorn
+
+os.environ.setdefault("GEMINI_API_KEY", "bench-fake-key")
+os.environ.setdefault("PROMPT_CACHE", "0")
+# Benchmark requests ask near-identical questions; measure the model path, not cache hits
+os.environ.setdefault("RESPONSE_CACHE", "0")
+# ...and don't treat a session's next turn as a resend of the previous one
+os.environ.setdefault("DEDUP_WINDOW_SECONDS", "0")
+
+import fake_genai  # noqa: E402
+import fake_redis  # noqa: E402
+import main  # noqa: E402
+from history import HistoryCompactor, history_tokens, pinned_messages, summary_messages, transcript  # noqa: E402
+from llm import ChatSessionCache  # noqa: E402
+from metrics import LatencyTracker  # noqa: E402
+from resilience import CircuitBreaker, ModelCallGuard  # noqa: E402
+from sessions import MemorySessionStore, RedisSessionStore, SessionConflict, SQLiteSessionStore  # noqa: E402
+
+RealGenerativeModel = fake_genai.install(main.genai)
+
+
+def rss_mb() -> float:
+    """Resident set size of this process (the server and the load generator share it)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # No procfs (e.g. macOS): fall back to peak RSS, which is reported in bytes there
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**20
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a short sleep."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lag = LatencyTracker(max_samples=100_000)
+        self._window_max = 0.0
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.lag.record("loop", lag)
+            self._window_max = max(self._window_max, lag)
+
+    def take_window_max(self) -> float:
+        """Worst lag since the previous call."""
+        worst, self._window_max = self._window_max, 0.0
+        return worst
+
+
+class ServerThread:
+    """Runs the app under uvicorn on its own thread and event loop.
+
+    Serving over a real socket lets streamed bytes reach the client as they are
+    flushed, and keeping the load generator off the server's loop means the
+    measured loop lag is the app's own.
+    """
+
+    def __init__(self, app, port: int):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.monitor = LoopLagMonitor()
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True)
+
+    async def _serve(self):
+        monitor = asyncio.create_task(self.monitor.run())
+        try:
+            await self.server.serve()
+        finally:
+            monitor.cancel()
+
+    def __enter__(self):
+        self._thread.start()
+        while not self.server.started:
+            if not self._thread.is_alive():
+                raise RuntimeError("Benchmark server failed to start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self._thread.join()
+
+
+async def run_level(client: httpx.AsyncClient, args, guests: int, progress: dict) -> dict:
+    """Play `args.requests` chat turns with `guests` concurrent guests.
+
+    Turn i goes to session i % args.sessions; a session is reset every
+    `args.reset_every` turns, and `args.page_ratio` of turns also load the page.
+    Model-bound messages get the turn number appended, so concurrent turns of
+    one session are separate model calls rather than one shared in-flight call.
+    """
+    rng = random.Random(args.seed + guests)
+    turns = iter(range(args.requests))
+    session_turns = defaultdict(int)
+    latency = LatencyTracker(max_samples=args.requests * 3)
+    errors = defaultdict(int)
+    chat_path = "/chat/stream" if args.stream else "/chat"
+    local = main.fast_path is not None and main.fast_path.answer(args.message) is not None
+
+    async def call(method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            r = await client.request(method, path, **kwargs)
+            # Streamed turns report failures in-band as an SSE error event
+            failed = r.status_code >= 400 or (path == "/chat/stream" and "event: error" in r.text)
+        except httpx.HTTPError:
+            failed = True
+        latency.record(path, time.perf_counter() - start)
+        errors[path] += failed
+        progress["requests"] += 1
+
+    async def guest():
+        for i in turns:
+            session_id = f"bench_{guests}_{i % args.sessions}"
+            message = args.message if local else f"{args.message} (turn {i})"
+            await call("POST", chat_path, json={"message": message, "session_id": session_id})
+            session_turns[session_id] += 1
+            if args.reset_every and session_turns[session_id] % args.reset_every == 0:
+                await call("POST", "/reset", params={"session_id": session_id})
+            if rng.random() < args.page_ratio:
+                await call("GET", "/")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(guest() for _ in range(guests)))
+    return {"guests": guests, "elapsed": time.perf_counter() - start, "latency": latency, "errors": errors}
+
+
+async def sample_timeline(server: ServerThread, progress: dict, interval: float, rows: list):
+    """Append (seconds, requests/s, RSS MB, worst loop lag) every `interval` seconds."""
+    start = last = time.perf_counter()
+    done = 0
+    while True:
+        try:
+            await asyncio.sleep(interval)
+        finally:
+            # Also record the partial interval when the run ends (the task is cancelled)
+            now = time.perf_counter()
+            rows.append((now - start, (progress["requests"] - done) / max(now - last, 1e-9), rss_mb(),
+                         server.monitor.take_window_max()))
+            done, last = progress["requests"], now
+
+
+async def time_to_first_byte(client: httpx.AsyncClient, path: str) -> tuple[float, float]:
+    """Return (seconds to first body byte, seconds to complete body) for one request."""
+    start = time.perf_counter()
+    first = None
+    async with client.stream("POST", path, json={"message": "Show me the menu", "session_id": "bench_ttfb"}) as r:
+        r.raise_for_status()
+        async for _ in r.aiter_raw():
+            if first is None:
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+async def run_ttfb(client: httpx.AsyncClient, args) -> int:
+    """Compare time to first byte of /chat and /chat/stream; fail if streaming doesn't cut it."""
+    print(f"fake model: {args.latency * 1000:.0f} ms to first token, "
+          f"{args.tokens} tokens at {args.token_delay * 1000:.0f} ms each; median of {args.runs} requests")
+    print(f"{'endpoint':>14} {'ttfb ms':>10} {'total ms':>10}")
+    ttfb = {}
+    for path in ("/chat", "/chat/stream"):
+        samples = [await time_to_first_byte(client, path) for _ in range(args.runs)]
+        first, total = (statistics.median(values) for values in zip(*samples))
+        ttfb[path] = first
+        print(f"{path:>14} {first * 1000:>10.1f} {total * 1000:>10.1f}")
+
+    if (args.tokens - 1) * args.token_delay < args.latency:
+        print("reply too short to gain from streaming; not checked (try --tokens 40 --token-delay 0.02)")
+        return 0
+    ratio = ttfb["/chat/stream"] / ttfb["/chat"]
+    if ratio > args.max_ttfb_ratio:
+        print(f"FAIL /chat/stream ttfb is {ratio:.2f} of /chat's (max {args.max_ttfb_ratio:.2f})")
+        return 1
+    return 0
+
+
+async def post_chats(client: httpx.AsyncClient, session_ids: list[str], message: str) -> list[tuple]:
+    """Send one /chat per session, all at once; return (status, reply or None, seconds) for each."""
+    async def post(session_id: str) -> tuple:
+        start = time.perf_counter()
+        r = await client.post("/chat", json={"message": message, "session_id": session_id})
+        reply = r.json()["response"] if r.status_code == 200 else None
+        return r.status_code, reply, time.perf_counter() - start
+    return await asyncio.gather(*(post(session_id) for session_id in session_ids))
+
+
+async def run_resilience(client: httpx.AsyncClient, args) -> int:
+    """Fault-injection checks of the model call guard through /chat; return 1 if any fails.
+
+    Each scenario swaps in a guard with short timeouts and backoff so the run
+    takes a few seconds, then injects errors, hangs or load with the fake model.
+    """
+    failures = []
+
+    def check(ok: bool, what: str):
+        print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+        if not ok:
+            failures.append(what)
+
+    def install_guard(**limits) -> ModelCallGuard:
+        main.model_guard = ModelCallGuard(backoff_base=0.01, backoff_max=0.05, **limits)
+        return main.model_guard
+
+    live_guard = main.model_guard
+    try:
+        print("transient errors: 30% of calls fail with 429/503")
+        fake_genai.configure(seed=args.seed, latency=0.01, tokens=1, token_delay=0, error_rate=0.3, hang_rate=0)
+        guard = install_guard(retries=2, breaker=CircuitBreaker(failure_threshold=1000))
+        results = await post_chats(client, [f"retry{i}" for i in range(40)], args.message)
+        degraded = sum(reply == main.DEGRADED_REPLY for _, reply, _ in results)
+        check(guard.counters["retries"] > 0, f"failed attempts retried ({guard.counters['retries']} retries)")
+        check(all(status == 200 for status, _, _ in results) and degraded <= 4,
+              f"{degraded}/40 turns degraded after retries (at most 4 expected)")
+
+        print("outage: every call fails")
+        fake_genai.configure(error_rate=1.0)
+        guard = install_guard(retries=1, breaker=CircuitBreaker(failure_threshold=3, reset_seconds=60))
+        calls = fake_genai.FakeConfig.calls
+        results = [(await post_chats(client, [f"outage{i}"], args.message))[0] for i in range(10)]
+        check(guard.breaker.state == "open" and guard.breaker.opens == 1, "circuit breaker opens")
+        check(fake_genai.FakeConfig.calls - calls == 3,
+              f"upstream left alone while open ({fake_genai.FakeConfig.calls - calls} calls for 10 turns)")
+        check(all(status == 200 and reply == main.DEGRADED_REPLY for status, reply, _ in results),
+              "guests get the degraded reply, not an error")
+
+        print("overload: 12 guests at once, 2 call slots and 2 queue places, 300 ms calls")
+        fake_genai.configure(error_rate=0.0, latency=0.3)
+        guard = install_guard(max_concurrent=2, max_queued=2, queue_timeout=5)
+        results = await post_chats(client, [f"overload{i}" for i in range(12)], args.message)
+        rejected = [seconds for status, _, seconds in results if status == 503]
+        check(len(rejected) == 8 and guard.counters["rejected_overloaded"] == 8,
+              f"calls beyond the slots and queue rejected ({len(rejected)} of 12)")
+        check(bool(rejected) and max(rejected) < 0.3,
+              f"rejected at once ({max(rejected, default=0) * 1000:.0f} ms max)")
+        check(sum(status == 200 for status, _, _ in results) == 4, "admitted calls answered")
+
+        print("hang: the model never answers")
+        fake_genai.configure(latency=0.01, hang_rate=1.0)
+        guard = install_guard(attempt_timeout=0.2, deadline=0.5, retries=2)
+        ((status, reply, seconds),) = await post_chats(client, ["hang"], args.message)
+        check(guard.counters["timeouts"] >= 2, f"attempts time out ({guard.counters['timeouts']} timeouts)")
+        check(reply == main.DEGRADED_REPLY and seconds < 1.0,
+              f"turn given up within the deadline ({seconds * 1000:.0f} ms, degraded reply)")
+    finally:
+        main.model_guard = live_guard
+        fake_genai.configure(error_rate=args.error_rate, hang_rate=args.hang_rate, latency=args.latency,
+                             tokens=args.tokens, token_delay=args.token_delay)
+
+    return 1 if failures else 0
+
+
+async def run_overhead(args):
+    """Per-turn client-side cost of the real SDK with the network call stubbed out.
+
+    before: a new GenerativeModel and a chat rebuilt from the full history every turn
+    after:  one shared model and the session's chat object reused between turns
+    """
+    from google.generativeai import protos
+
+    reply = protos.GenerateContentResponse(candidates=[protos.Candidate(
+        content=protos.Content(role="model", parts=[protos.Part(text="Certainly! " * 30)]),
+        finish_reason=protos.Candidate.FinishReason.STOP,
+    )])
+
+    class StubClient:
+        async def generate_content(self, request, **kwargs):
+            return reply
+
+    def new_model():
+        model = RealGenerativeModel(model_name=main.MODEL_NAME, system_instruction=main.SYSTEM_PROMPT)
+        model._async_client = StubClient()
+        return model
+
+    message = "Could you tell me more about the breakfast packages and their prices?"
+
+    async def turns(next_chat, checkin=None) -> float:
+        history = []
+        start = time.perf_counter()
+        for _ in range(args.turns):
+            history = (history + [{"role": "user", "parts": [message]}])[-args.window:]
+            chat = next_chat(history)
+            response = await chat.send_message_async(message)
+            history = history + [{"role": "model", "parts": [response.text]}]
+            if checkin:
+                checkin(chat, history)
+        return (time.perf_counter() - start) / args.turns
+
+    before = await turns(lambda history: new_model().start_chat(history=history[:-1]))
+
+    model = new_model()
+    cache = ChatSessionCache()
+    after = await turns(
+        lambda history: cache.checkout("bench", model, history),
+        lambda chat, history: cache.checkin("bench", chat, history),
+    )
+
+    print(f"{args.turns} turns, {args.window}-message window, network stubbed")
+    print(f"{'':>8} {'us/turn':>10}")
+    print(f"{'before':>8} {before * 1e6:>10.0f}")
+    print(f"{'after':>8} {after * 1e6:>10.0f}  (chat reused on {cache.hits}/{args.turns} turns)")
+
+
+async def run_compaction(args):
+    """Replay a recorded conversation: fixed 20-message window vs token-budgeted history.
+
+    Summaries are produced by a fake summarizer (first 120 words) and awaited
+    between turns, as if the background task finished before the guest replied.
+    """
+    with open(args.fixture) as f:
+        messages = json.load(f)["messages"]
+
+    async def summarize(previous, older):
+        text = f"{previous or ''} {transcript(older)}"
+        return " ".join(text.split()[:120])
+
+    store = MemorySessionStore()
+    compactor = HistoryCompactor(store, summarize, budget_tokens=args.budget)
+
+    rows = []
+    fit_seconds = 0.0
+    for i in range(0, len(messages), 2):
+        user, reply = messages[i], messages[i + 1]
+        fixed_window = messages[:i + 1][-20:]
+
+        start = time.perf_counter()
+        history = await store.load("bench") + [user]
+        window, overflow = compactor.fit(history)
+        fit_seconds += time.perf_counter() - start
+
+        rows.append((i // 2 + 1, history_tokens(fixed_window), history_tokens(window)))
+        await store.save("bench", window + [reply])
+        compactor.compact_later("bench", overflow)
+        await compactor.drain()
+
+    print(f"{len(rows)} turns from {args.fixture}, budget {args.budget} tokens, "
+          f"prefill estimated at {args.prefill_rate:.0f} tokens/s")
+    print(f"{'turn':>5} {'fixed-20 tok':>13} {'budgeted tok':>13}")
+    for turn, fixed, budgeted in rows:
+        print(f"{turn:>5} {fixed:>13} {budgeted:>13}")
+
+    fixed_total = sum(r[1] for r in rows)
+    budgeted_total = sum(r[2] for r in rows)
+    print(f"{'max':>5} {max(r[1] for r in rows):>13} {max(r[2] for r in rows):>13}")
+    print(f"{'total':>5} {fixed_total:>13} {budgeted_total:>13}  "
+          f"({100 * (1 - budgeted_total / fixed_total):.0f}% fewer history tokens)")
+    print(f"est. prefill saved: {(fixed_total - budgeted_total) / args.prefill_rate * 1000 / len(rows):.1f} ms/turn; "
+          f"fit cost {fit_seconds / len(rows) * 1e6:.0f} us/turn; {compactor.counters['compactions']} summaries")
+
+
+# Started in a fresh interpreter per run, so imports are measured cold
+STARTUP_CHILD = """
+import json, os, sys, time
+started = time.perf_counter()
+if os.environ.get("BENCH_EAGER_SDK") == "1":
+    import google.generativeai  # as main.py did before the SDK import was deferred
+import main
+imported = time.perf_counter() - started
+# The SDK or its grpc/protobuf stack, e.g. via google.api_core
+sdk_loaded = any(name in sys.modules for name in ("google.generativeai", "google.api_core", "grpc"))
+import fake_genai, uvicorn
+fake_genai.configure(latency=float(sys.argv[2]))
+# Assigned directly: fake_genai.install reads the original class, which would import the SDK
+main.genai.GenerativeModel = fake_genai.FakeGenerativeModel
+print(json.dumps({"import": imported, "sdk_loaded": sdk_loaded}), flush=True)
+uvicorn.run(main.app, host="127.0.0.1", port=int(sys.argv[1]), log_level="warning")
+"""
+
+STARTUP_SCENARIOS = [
+    ("eager import", {"BENCH_EAGER_SDK": "1", "WARM_UP": "0"}),
+    ("lazy, no warm-up", {"WARM_UP": "0"}),
+    ("lazy + warm-up", {"WARM_UP": "1"}),
+]
+
+
+def wait_until_ok(client: httpx.Client, path: str, started: float, timeout: float = 60) -> float:
+    """Poll `path` until it answers 200; return seconds since `started`."""
+    while time.perf_counter() - started < timeout:
+        try:
+            if client.get(path).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"{path} not OK after {timeout:.0f}s")
+
+
+def measure_startup(args, env: dict) -> dict:
+    """Boot the app in a new process; time import, /health, /ready and the first two /chat turns."""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", STARTUP_CHILD, str(args.port), str(args.latency)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, **env},
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        row = json.loads(process.stdout.readline())
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=60) as client:
+            row["health"] = wait_until_ok(client, "/health", started)
+            row["ready"] = wait_until_ok(client, "/ready", started)
+            for turn in ("first_chat", "second_chat"):
+                sent = time.perf_counter()
+                client.post("/chat", json={"message": args.message, "session_id": f"bench_{turn}"}).raise_for_status()
+                row[turn] = time.perf_counter() - sent
+        return row
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run_startup(args):
+    """Cold start: module import, time to /health and /ready, and first vs second /chat latency.
+
+    /chat is sent as soon as /ready answers, like a load balancer would. The
+    SDK is the real one; only model calls go to the fake.
+    """
+    print(f"{args.runs} runs per scenario (median), fake model latency {args.latency * 1000:.0f} ms, "
+          f"times in ms from process start")
+    print(f"{'scenario':>18} {'import':>8} {'/health':>8} {'/ready':>8} {'1st chat':>9} {'2nd chat':>9}  SDK at import")
+    for name, env in STARTUP_SCENARIOS:
+        rows = [measure_startup(args, env) for _ in range(args.runs)]
+        median = {key: statistics.median(r[key] for r in rows) * 1000
+                  for key in ("import", "health", "ready", "first_chat", "second_chat")}
+        print(f"{name:>18} {median['import']:>8.0f} {median['health']:>8.0f} {median['ready']:>8.0f} "
+              f"{median['first_chat']:>9.1f} {median['second_chat']:>9.1f}  "
+              f"{'loaded' if rows[0]['sdk_loaded'] else 'deferred'}")
+
+
+def run_fastpath(args) -> int:
+    """Check the fast path against fixtures/fast_path_cases.json; 1 if any case regressed."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "fast_path_cases.json")) as f:
+        cases = json.load(f)["cases"]
+    failures = 0
+    started = time.perf_counter()
+    for case in cases:
+        reply = main.fast_path.answer(case["message"], first_turn=case.get("first_turn", True))
+        expected = case["answer"]
+        ok = reply is None if expected is None else reply is not None and expected in reply
+        failures += not ok
+        if not ok:
+            print(f"FAIL: {case['message']!r} -> {reply!r} (expected {expected or 'model'!r})")
+    elapsed = time.perf_counter() - started
+    print(f"{len(cases) - failures}/{len(cases)} fast path cases OK, {elapsed / len(cases) * 1e6:.0f} us/message")
+    return 1 if failures else 0
+
+
+def session_backends(args, directory: str) -> dict:
+    """Factories building a fresh store per check for each backend."""
+    counter = iter(range(1_000_000))
+
+    def redis_store(**policy):
+        if args.redis_url:
+            import redis.asyncio as redis
+            return RedisSessionStore(client=redis.from_url(args.redis_url), prefix=f"bench:{os.getpid()}:{next(counter)}:",
+                                     **policy)
+        return RedisSessionStore(client=fake_redis.FakeRedis(), **policy)
+
+    return {
+        "memory": lambda **policy: MemorySessionStore(**policy),
+        "sqlite": lambda **policy: SQLiteSessionStore(os.path.join(directory, f"{next(counter)}.db"), **policy),
+        "redis": redis_store,
+    }
+
+
+def turn(i: int) -> list:
+    return [{"role": "user", "parts": [f"question {i}"]}, {"role": "model", "parts": [f"answer {i}"]}]
+
+
+async def check_session_store(make_store) -> list[str]:
+    """Run the store contract against one backend; return the failed checks."""
+    failures = []
+
+    def check(ok: bool, what: str):
+        if not ok:
+            failures.append(what)
+
+    store = make_store()
+    check(await store.load("missing") == [], "unknown session loads as []")
+    await store.save("a", turn(1))
+    loaded = await store.load("a")
+    check(loaded == turn(1), "save/load round trip")
+    loaded.append({"role": "user", "parts": ["not saved"]})
+    check(await store.load("a") == turn(1), "load returns a copy")
+    await store.delete("a")
+    check(await store.load("a") == [], "delete")
+    check((await store.stats())["live_sessions"] == 0, "delete drops the session from stats")
+
+    async def conflicts(session_id: str, version: str) -> bool:
+        try:
+            await store.save(session_id, turn(9), version=version)
+        except SessionConflict:
+            return True
+        return False
+
+    # Two workers load the same version; the second save must not overwrite the first
+    _, version = await store.load_versioned("v")
+    await store.save("v", turn(1), version=version)
+    check(await conflicts("v", version), "save of a new session created meanwhile conflicts")
+    history, version = await store.load_versioned("v")
+    await store.save("v", history + turn(2), version=version)
+    check(await conflicts("v", version), "save at a stale version conflicts")
+    check(await store.load("v") == turn(1) + turn(2), "conflicting save stores nothing")
+    _, version = await store.load_versioned("v")
+    check(not await conflicts("v", version), "save at the current version succeeds")
+
+    store = make_store(max_bytes=300)
+    history = [m for i in range(10) for m in turn(i)]
+    await store.save("a", history)
+    trimmed = await store.load("a")
+    check(0 < len(trimmed) < len(history) and trimmed[-1] == history[-1], "history trimmed to the byte budget")
+    check(store.trimmed_messages == len(history) - len(trimmed), "trimmed messages counted")
+
+    store = make_store(max_messages=3, pinned=pinned_messages)
+    await store.save("a", summary_messages("earlier turns") + turn(1) + turn(2))
+    check(await store.load("a") == summary_messages("earlier turns") + turn(2),
+          "trim keeps the summary pair and whole turns")
+
+    store = make_store(max_sessions=3)
+    for i in range(3):
+        await store.save(f"s{i}", turn(i))
+    await store.load("s0")  # s1 is now the least recently used
+    await store.save("s3", turn(3))
+    stats = await store.stats()
+    check(await store.load("s1") == [] and await store.load("s0") == turn(0), "LRU evicts the least recently used")
+    check(stats["live_sessions"] == 3 and store.evictions["lru"] == 1, "LRU eviction counted")
+    check(stats["approx_bytes"] > 0, "stats report bytes")
+
+    store = make_store(ttl_seconds=1)
+    await store.save("old", turn(1))
+    await asyncio.sleep(1.2)
+    check(await store.load("old") == [], "idle session expires")
+    await store.save("new", turn(2))
+    stats = await store.stats()
+    check(stats["live_sessions"] == 1 and store.evictions["ttl"] == 1, "expired session dropped from the index")
+    return failures
+
+
+async def run_sessions(args) -> int:
+    """Check every session backend against the same contract, then time a load+save turn."""
+    failed = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for name, make_store in session_backends(args, directory).items():
+            failures = await check_session_store(make_store)
+            store = make_store()
+            history = [m for i in range(10) for m in turn(i)]
+            started = time.perf_counter()
+            for i in range(args.turns):
+                session_id = f"s{i % args.sessions}"
+                await store.save(session_id, (await store.load(session_id) or history)[-20:] + turn(i))
+            per_turn = (time.perf_counter() - started) / args.turns
+            target = args.redis_url if name == "redis" and args.redis_url else ""
+            if name == "redis" and not args.redis_url:
+                target = "in-process stand-in (fake_redis.py)"
+            print(f"{name:>7}: {'OK' if not failures else 'FAIL'}  {per_turn * 1e6:>7.0f} us/turn  {target}")
+            for failure in failures:
+                print(f"         FAIL: {failure}")
+            failed += bool(failures)
+    return 1 if failed else 0
+
+
+async def run(args) -> int:
+    if args.mode == "overhead":
+        await run_overhead(args)
+        return 0
+    if args.mode == "compaction":
+        await run_compaction(args)
+        return 0
+    if args.mode == "startup":
+        run_startup(args)
+        return 0
+    if args.mode == "fastpath":
+        return run_fastpath(args)
+    if args.mode == "sessions":
+        return await run_sessions(args)
+
+    fake_genai.configure(
+        seed=args.seed,
+        latency=args.latency,
+        tokens=args.tokens,
+        token_delay=args.token_delay,
+        error_rate=args.error_rate,
+        error_codes=tuple(args.error_codes),
+        hang_rate=args.hang_rate,
+    )
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    with ServerThread(main.app, args.port) as server:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+            if args.mode == "ttfb":
+                return await run_ttfb(client, args)
+            if args.mode == "resilience":
+                return await run_resilience(client, args)
+            return await run_load(client, server, args)
+
+
+async def run_load(client: httpx.AsyncClient, server: ServerThread, args) -> int:
+    print(f"fake model: {args.latency * 1000:.0f} ms to first token, {args.tokens} tokens at "
+          f"{args.token_delay * 1000:.0f} ms each, {args.error_rate:.0%} errors "
+          f"({'/'.join(map(str, args.error_codes))}), {args.hang_rate:.0%} hangs; {args.requests} turns per level over {args.sessions} sessions")
+
+    progress = {"requests": 0}
+    timeline = []
+    rss_start = rss_mb()
+    sampler = asyncio.create_task(sample_timeline(server, progress, args.sample_interval, timeline))
+
+    failures = []
+    print(f"{'guests':>7} {'endpoint':<13} {'req/s':>8} {'count':>6} {'errors':>7} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for guests in args.concurrency:
+        result = await run_level(client, args, guests, progress)
+        latency, errors = result["latency"], result["errors"]
+        for path, count in latency.counts.items():
+            p99_ms = latency.percentile(path, 0.99) * 1000
+            print(f"{guests:>7} {path:<13} {count / result['elapsed']:>8.1f} {count:>6} {errors[path]:>7} "
+                  f"{latency.percentile(path, 0.50) * 1000:>9.1f} {latency.percentile(path, 0.95) * 1000:>9.1f} "
+                  f"{p99_ms:>9.1f}")
+            if path.startswith("/chat"):
+                if args.max_p99_ms and p99_ms > args.max_p99_ms:
+                    failures.append(f"{guests} guests: {path} p99 {p99_ms:.1f} ms > {args.max_p99_ms:.1f} ms")
+                if args.max_error_rate is not None and errors[path] / count > args.max_error_rate:
+                    failures.append(f"{guests} guests: {path} error rate {errors[path] / count:.3f} "
+                                    f"> {args.max_error_rate:.3f}")
+
+    sampler.cancel()
+    await asyncio.wait([sampler])
+    rss_end = rss_mb()
+    lag = server.monitor.lag
+
+    print(f"\ntimeline (every {args.sample_interval:g} s)")
+    print(f"{'t s':>7} {'req/s':>8} {'rss MB':>8} {'lag max ms':>11}")
+    for elapsed, rate, rss, worst_lag in timeline:
+        print(f"{elapsed:>7.1f} {rate:>8.1f} {rss:>8.1f} {worst_lag * 1000:>11.1f}")
+
+    print(f"\nRSS {rss_start:.1f} -> {rss_end:.1f} MB ({rss_end - rss_start:+.1f} MB); "
+          f"event-loop lag p50 {lag.percentile('loop', 0.50) * 1000:.1f} ms, "
+          f"p99 {lag.percentile('loop', 0.99) * 1000:.1f} ms, max {lag.percentile('loop', 1.0) * 1000:.1f} ms")
+    print(f"fake model calls {fake_genai.FakeConfig.calls}, injected errors {fake_genai.FakeConfig.errors}, "
+          f"hangs {fake_genai.FakeConfig.hangs}")
+
+    stats = (await client.get("/stats")).json()
+    print(f"offloaded ratio {stats['offloaded_ratio']:.2f}")
+    print("model calls " + ", ".join(f"{key} {value}" for key, value in stats["model_calls"].items()))
+    for path, values in stats["paths"].items():
+        print(f"  {path:<15} n={values['count']:<6} p50 {values['p50_ms']:.2f} ms  p99 {values['p99_ms']:.2f} ms")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["load", "ttfb", "resilience", "overhead", "compaction", "startup", "fastpath", "sessions"], default="load",
+                        help="load: /chat, /reset and / per concurrency level; ttfb: /chat vs /chat/stream; "
+                             "resilience: retries, circuit breaker, overload and hang checks with injected faults; "
+                             "overhead: per-turn SDK cost without network; "
+                             "compaction: history tokens on a recorded conversation; "
+                             "startup: cold start import time and first-request latency; "
+                             "fastpath: local answers vs fixtures/fast_path_cases.json; "
+                             "sessions: session backend checks and load+save cost")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model time to first token in seconds")
+    parser.add_argument("--tokens", type=int, default=1, help="tokens per fake reply")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="fake model delay between tokens in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake model calls that fail")
+    parser.add_argument("--error-codes", type=lambda s: [int(x) for x in s.split(",")], default=[429, 503],
+                        help="comma-separated HTTP statuses of injected errors")
+    parser.add_argument("--hang-rate", type=float, default=0.0,
+                        help="share of fake model calls that never answer (set MODEL_ATTEMPT_TIMEOUT_SECONDS)")
+    parser.add_argument("--message", default="Can you recommend something for a quiet dinner in my room?",
+                        help="message sent by every load request (a price or hours question takes the fast path)")
+    parser.add_argument("--requests", type=int, default=64, help="chat turns per concurrency level")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 8, 32],
+                        help="comma-separated numbers of concurrent guests")
+    parser.add_argument("--sessions", type=int, default=16, help="distinct sessions per concurrency level")
+    parser.add_argument("--reset-every", type=int, default=4, help="reset a session after this many turns (0: never)")
+    parser.add_argument("--page-ratio", type=float, default=0.1, help="share of turns that also load the chat page")
+    parser.add_argument("--stream", action="store_true", help="send turns to /chat/stream instead of /chat")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="seconds between timeline samples")
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="fail if any chat p99 exceeds this")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="fail if any chat error rate exceeds this")
+    parser.add_argument("--max-ttfb-ratio", type=float, default=0.5,
+                        help="ttfb: fail if /chat/stream time to first byte exceeds this share of /chat's")
+    parser.add_argument("--seed", type=int, default=0, help="seed for error injection and page loads")
+    parser.add_argument("--turns", type=int, default=200, help="turns for the overhead benchmark")
+    parser.add_argument("--window", type=int, default=20, help="history messages kept for the overhead benchmark")
+    parser.add_argument("--fixture", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures",
+                                                          "guest_conversation.json"),
+                        help="recorded conversation for the compaction benchmark")
+    parser.add_argument("--budget", type=int, default=1000, help="history token budget for the compaction benchmark")
+    parser.add_argument("--prefill-rate", type=float, default=5000, help="tokens/s used to estimate prefill time")
+    parser.add_argument("--redis-url", default=None,
+                        help="check the redis backend against this server instead of the in-process stand-in")
+    parser.add_argument("--runs", type=int, default=3, help="process starts per scenario (startup) or requests per endpoint (ttfb)")
+    parser.add_argument("--port", type=int, default=8765, help="local port for the benchmark server")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args())))
@@ -0,0 +1,398 @@
+"""
+Structured menu and hotel facts parsed from the system prompt, and a local
+intent matcher that answers simple lookups without calling the model.
+
+Handles:
+- hotel facts and hours ("what time is checkout", "pool hours", "how much is parking")
+- item prices ("how much is the American breakfast")
+- order totals ("total for two cappuccinos and a Caesar salad with delivery")
+
+Anything the matcher is not sure about returns None and goes to the model.
+"""
+
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+MENU_HEADING = "## COMPLETE IN-ROOM DINING MENU"
+
+DEFAULT_WINDOW = "6:30 AM - 11:00 PM"
+
+NUMBERS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+}
+
+STOPWORDS = {
+    "a", "an", "the", "of", "for", "with", "and", "or", "in", "on", "to", "at", "by", "from",
+    "please", "pls", "thanks", "thank", "you", "me", "my", "i", "id", "im", "we", "us", "our",
+    "how", "much", "is", "are", "was", "be", "it", "its", "this", "that", "what", "whats", "does", "do",
+    "would", "will", "could", "can", "like", "want", "get", "have", "some", "order", "ordering",
+    "price", "prices", "cost", "costs", "total", "come", "comes", "up", "if", "all", "together",
+    "portion", "full", "menu", "item", "just", "also", "then", "x",
+}
+
+# Messages containing these are requests or complaints, not lookups
+NOT_A_LOOKUP = re.compile(
+    r"\b(need|late|extend|extension|book|reserve|cancel|change|broken|dirty|noise|noisy|complain|"
+    r"complaint|problem|issue|not working|refund|allerg\w*|vegan|vegetarian|gluten|recommend|suggest)\b"
+)
+QUESTION_CUE = re.compile(r"\?|\b(whats?|when|how|hours?|time|open|close|closes|where|is there)\b")
+PRICE_CUE = re.compile(r"\b(how much|price|prices|cost|costs|total)\b")
+DELIVERY_CUE = re.compile(r"\b(with delivery|delivered|deliver(ed)? (it )?to|to my room|room delivery|delivery)\b")
+PICKUP_CUE = re.compile(r"\b(pick ?up|picking up|lobby)\b")
+ITEM_SEPARATOR = re.compile(r",|\band\b|\bplus\b|&")
+
+# What a fact question asks about; the question must contain the cue for its topic's attribute
+TIME_CUE = re.compile(r"\b(what time|when|hours?|open|opens|opening|close|closes|closing)\b")
+AVAILABLE_CUE = re.compile(r"\b(is there|do you have|have|available|free|included)\b")
+WHERE_CUE = re.compile(r"\b(where|whats|what)\b")
+
+# Fact topics: (keywords in the question, key of the parsed fact that answers it, attribute cues)
+FACT_TOPICS = [
+    (("checkout", "check out"), "check-out time", (TIME_CUE,)),
+    (("checkin", "check in"), "check-in time", (TIME_CUE,)),
+    (("pool", "whirlpool"), "pool", (TIME_CUE,)),
+    (("gym", "fitness center", "fitness"), "fitness center", (TIME_CUE,)),
+    (("business center",), "business center", (TIME_CUE,)),
+    (("wifi", "wi fi", "internet"), "wifi", (AVAILABLE_CUE,)),
+    (("parking", "valet"), "on-site parking", (PRICE_CUE,)),
+    (("delivery fee", "delivery charge"), "room delivery fee", (PRICE_CUE, WHERE_CUE)),
+    (("breakfast",), "breakfast", (TIME_CUE,)),
+    (("dinner", "lunch", "all day dining"), "all-day dining", (TIME_CUE,)),
+    (("address", "located", "location"), "address", (WHERE_CUE,)),
+    (("phone number", "phone"), "phone", (WHERE_CUE,)),
+]
+
+# Words a fact question may contain besides its topic and attribute, e.g. "what time does the pool close"
+FACT_FILLER = {
+    "time", "hour", "open", "opening", "close", "closing", "when", "where", "there", "free", "available",
+    "included", "hotel", "here", "your", "number", "fee", "charge", "served", "serve", "start", "until",
+    "daily", "usually", "today", "tonight",
+}
+
+# Follow-ups that lean on earlier turns ("can I pick it up instead?") need the conversation, i.e. the model
+REFERS_BACK = re.compile(
+    r"\b(it|its|that|those|these|them|they|same|another|again|instead|also|too|else|more|earlier|"
+    r"before|previous|above|mentioned|as well)\b"
+)
+
+
+def fold(text: str) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    text = unicodedata.normalize("NFKD", text.lower().replace("'", "").replace("\u2019", ""))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^a-z0-9.$ ]+", " ", text).split())
+
+
+def singular(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("oes"):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def tokens(text: str) -> list[str]:
+    return [singular(w) for w in fold(text).replace(".", " ").split() if w not in STOPWORDS]
+
+
+def money(amount: float) -> str:
+    return f"${amount:.2f}"
+
+
+@dataclass
+class MenuItem:
+    name: str
+    section: str
+    price: float
+    half_price: float | None
+    window: str
+    description: str = ""
+    name_tokens: frozenset = field(default_factory=frozenset)
+    context_tokens: frozenset = field(default_factory=frozenset)
+    # If set, the question must mention at least one of these (e.g. kids menu items)
+    required_tokens: frozenset = field(default_factory=frozenset)
+
+    @property
+    def display_name(self) -> str:
+        return " ".join(w if w in ("with", "and", "of", "or") else w.capitalize() for w in self.name.lower().split())
+
+
+@dataclass
+class Catalog:
+    items: list[MenuItem]
+    facts: dict[str, tuple[str, str | None]]
+    # name token -> indices of items whose name contains it
+    index: dict[str, set[int]]
+
+    @classmethod
+    def from_prompt(cls, prompt: str) -> "Catalog":
+        facts = parse_facts(prompt)
+        items = parse_menu(prompt, room_service_hours(facts))
+        index: dict[str, set[int]] = {}
+        for i, item in enumerate(items):
+            for token in item.name_tokens:
+                index.setdefault(token, set()).add(i)
+        return cls(items, facts, index)
+
+    def match(self, text: str) -> MenuItem | None:
+        """The single item whose name explains every word of `text`, or None if unclear.
+
+        When several items explain every word, the one whose full name is in
+        `text` wins ("two eggs" over "two boiled eggs"); otherwise the guest's
+        word fits several items ("curry", "salad") and it's left to the model.
+        """
+        query = set(tokens(text))
+        if not query:
+            return None
+        candidates = set().union(*(self.index.get(t, set()) for t in query))
+
+        matches = []
+        for i in candidates:
+            item = self.items[i]
+            if item.required_tokens and not item.required_tokens & query:
+                continue
+            if query - item.name_tokens - item.context_tokens:
+                continue
+            matches.append(item)
+        if len(matches) == 1:
+            return matches[0]
+        named = [item for item in matches if item.name_tokens <= query]
+        return named[0] if len(named) == 1 else None
+
+
+def parse_facts(prompt: str) -> dict[str, tuple[str, str | None]]:
+    """Hotel facts from the bullet lines before the menu, as lowercase key -> (label, value).
+
+    `- Key: Value` and `- Amenity (hours)` lines are split; other bullets are kept whole.
+    """
+    facts = {}
+    info = prompt.split(MENU_HEADING)[0]
+    for line in info.splitlines():
+        line = line.strip()
+        if not line.startswith("- "):
+            continue
+        line = line[2:]
+        m = re.match(r"([^:(]+):\s*(.+)$", line) or re.match(r"(.+?)\s*\((.+)\)$", line)
+        label, value = (m.group(1).strip(), m.group(2).strip()) if m else (line, None)
+        facts[label.lower()] = (label, value)
+    return facts
+
+
+def room_service_hours(facts: dict) -> str:
+    """Overall room service hours: breakfast start to all-day dining end."""
+    breakfast = re.match(r"([\d:]+ [AP]M)", (facts.get("breakfast") or ("", ""))[1] or "")
+    dining = re.search(r"- ([\d:]+ [AP]M)", (facts.get("all-day dining") or ("", ""))[1] or "")
+    if breakfast and dining:
+        return f"{breakfast.group(1)} - {dining.group(1)}"
+    return DEFAULT_WINDOW
+
+
+ITEM_LINE = re.compile(
+    r"^(?:- )?(?P<name>.+?) - \$(?P<price>\d+\.\d\d)(?: \(half \$(?P<half>\d+\.\d\d)\))?(?: \((?P<note>.*)\))?$"
+)
+WINDOW = re.compile(r"\((?:Available )?([\d:]+ [AP]M|noon) - ([\d:]+ [AP]M|noon)\)")
+
+
+def parse_menu(prompt: str, default_window: str) -> list[MenuItem]:
+    """Menu items with prices, half portions and serving windows from the dining menu section.
+
+    Returns no items (prices and totals then go to the model) if the prompt has no menu section.
+    """
+    if MENU_HEADING not in prompt:
+        logger.warning("No %r section in the prompt; menu questions will go to the model", MENU_HEADING)
+        return []
+    menu = prompt.split(MENU_HEADING, 1)[1].split("## ALLERGEN KEY")[0]
+    items: list[MenuItem] = []
+    section, section_window, block_window = "", default_window, None
+    group, window = "", default_window
+    last_item = None
+
+    for raw in menu.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line == "---":
+            block_window = None  # serving windows carry over between sections only up to a divider
+            last_item = None
+            continue
+
+        if line.startswith("### "):
+            m = WINDOW.search(line)
+            section = WINDOW.sub("", line[4:]).strip()
+            if m:
+                block_window = f"{m.group(1)} - {m.group(2)}"
+            section_window = block_window or default_window
+            group, window = "", section_window
+            last_item = None
+            continue
+
+        if line.endswith(":") and WINDOW.sub("", line).upper() == WINDOW.sub("", line):
+            m = WINDOW.search(line)
+            group = WINDOW.sub("", line[:-1]).strip()
+            window = f"{m.group(1)} - {m.group(2)}" if m else section_window
+            last_item = None
+            continue
+
+        m = ITEM_LINE.match(line)
+        if not m:
+            if last_item is not None and not last_item.description:
+                last_item.description = line
+            continue
+
+        name = re.sub(r"\s*\(.*?\)", "", m.group("name")).replace('"', "").strip()
+        context = f"{section} {group}"
+        kids = "KIDS" in section
+        last_item = MenuItem(
+            name=name,
+            section=f"{section} - {group}".title() if group else section.title(),
+            price=float(m.group("price")),
+            half_price=float(m.group("half")) if m.group("half") else None,
+            window=window,
+            description=m.group("note") or "",
+            name_tokens=frozenset(tokens(name)),
+            context_tokens=frozenset(tokens(context)) | ({"kid", "child", "children"} if kids else frozenset()),
+            required_tokens=frozenset({"kid", "child", "children"}) if kids else frozenset(),
+        )
+        items.append(last_item)
+    return items
+
+
+class FastPathEngine:
+    """Answers fact, price and order-total questions directly from the catalog."""
+
+    def __init__(self, catalog: Catalog, delivery_fee: float | None = None):
+        self.catalog = catalog
+        if delivery_fee is None:
+            m = re.search(r"\$(\d+\.\d\d)", catalog.facts.get("room delivery fee", ("", ""))[1] or "")
+            delivery_fee = float(m.group(1)) if m else 0.0
+        self.delivery_fee = delivery_fee
+
+    def answer(self, message: str, first_turn: bool = True) -> str | None:
+        """The local reply to `message`, or None to ask the model.
+
+        After the first turn, messages that refer back to the conversation are
+        left to the model even if they mention a known fact or item.
+        """
+        text = fold(message.replace("-", " "))
+        if len(text.split()) > 25 or NOT_A_LOOKUP.search(text):
+            return None
+        if not first_turn and REFERS_BACK.search(text):
+            return None
+        if PRICE_CUE.search(text):
+            reply = self._price_or_total(text)
+            if reply is not None:
+                return reply
+        if QUESTION_CUE.search(text) or "?" in message:
+            return self._fact(text)
+        return None
+
+    def _fact(self, text: str) -> str | None:
+        """Answer only when the question asks for its topic's attribute and every other word is explained."""
+        topics = [(key, keywords, cues) for keywords, key, cues in FACT_TOPICS
+                  if any(re.search(rf"\b{k}\b", text) for k in keywords)]
+        if len(topics) != 1:
+            return None
+        topic, keywords, cues = topics[0]
+        if not any(cue.search(text) for cue in cues):
+            return None
+        explained = FACT_FILLER.union(*(tokens(k) for k in keywords))
+        if set(tokens(text)) - explained:
+            return None
+        if topic in self.catalog.facts:
+            matches = [self.catalog.facts[topic]]
+        else:
+            matches = [fact for key, fact in self.catalog.facts.items() if topic in key]
+        if len(matches) != 1:
+            return None
+        label, value = matches[0]
+        if value is None:
+            return f"{label}."
+        if topic in ("breakfast", "all-day dining"):
+            return f"In-room {label.lower()} is served {value}."
+        if topic == "room delivery fee":
+            return f"The room delivery fee is {value}."
+        return f"{label}: {value}."
+
+    def _price_or_total(self, text: str) -> str | None:
+        delivery = bool(DELIVERY_CUE.search(text))
+        pickup = bool(PICKUP_CUE.search(text))
+        text = DELIVERY_CUE.sub(" ", text)
+        text = PICKUP_CUE.sub(" ", text)
+
+        lines = self._parse_order(text)
+        if not lines:
+            return None
+
+        if len(lines) == 1 and lines[0][0] == 1 and not delivery and not pickup and "total" not in text:
+            _, item, half = lines[0]
+            price = f"{money(item.price)}"
+            if item.half_price is not None:
+                price += f" (half portion {money(item.half_price)})"
+            if half:
+                price = f"{money(item.half_price)} for a half portion"
+            return (f"{item.display_name} ({item.section}) is {price}. "
+                    f"It is served {item.window}. Would you like to order it?")
+
+        rows = []
+        subtotal = 0.0
+        for qty, item, half in lines:
+            cost = qty * (item.half_price if half else item.price)
+            subtotal += cost
+            rows.append(f"- {qty} x {item.display_name}{' (half)' if half else ''} - {money(cost)}")
+
+        if delivery:
+            rows.append(f"- Room delivery fee - {money(self.delivery_fee)}")
+            rows.append(f"Total: {money(subtotal + self.delivery_fee)}")
+        elif pickup:
+            rows.append(f"Total: {money(subtotal)} (free pickup at the lobby counter)")
+        else:
+            rows.append(f"Subtotal: {money(subtotal)}")
+            rows.append(f"With the {money(self.delivery_fee)} room delivery fee: "
+                        f"{money(subtotal + self.delivery_fee)}, or free pickup at the lobby counter.")
+        return "Here is your total:\n" + "\n".join(rows) + "\nWould you like me to place this order?"
+
+    def _parse_order(self, text: str) -> list[tuple[int, MenuItem, bool]] | None:
+        """Split into (quantity, item, half portion) lines; None if any part is not a known item."""
+        text = PRICE_CUE.sub(" ", text)
+        parts = [p.strip() for p in ITEM_SEPARATOR.split(text)]
+        parts = [p for p in parts if tokens(p) or p.split() and p.split()[0] in NUMBERS]
+
+        lines = []
+        i = 0
+        while i < len(parts):
+            # Item names can contain separators ("banana & cranberry porridge"), so try the longest span first
+            for j in range(len(parts), i, -1):
+                line = self._parse_line(" and ".join(parts[i:j]))
+                if line is not None:
+                    lines.append(line)
+                    i = j
+                    break
+            else:
+                return None
+        return lines
+
+    def _parse_line(self, text: str) -> tuple[int, MenuItem, bool] | None:
+        words = [w for w in text.split() if w not in STOPWORDS or w in NUMBERS]
+        half = "half" in words
+        words = [w for w in words if w != "half"]
+        if not words:
+            return None
+
+        item = self.catalog.match(" ".join(words))
+        qty = 1
+        first = singular(words[0])
+        if item is not None and (first.isdigit() or first in NUMBERS) and first not in item.name_tokens:
+            qty = int(first) if first.isdigit() else NUMBERS[first]
+        elif item is None and (first.isdigit() or first in NUMBERS):
+            qty = int(first) if first.isdigit() else NUMBERS[first]
+            item = self.catalog.match(" ".join(words[1:]))
+        if item is None or (half and item.half_price is None) or qty < 1:
+            return None
+        return qty, item, half
@@ -0,0 +1,145 @@
+"""
+Local stand-in for the parts of `google.generativeai` the app uses.
+
+Replies are generated after a configurable time to first token and per-token
+delay, optionally streamed chunk by chunk. A share of calls can fail with the
+same `google.api_core` exceptions the real SDK raises (429, 503, ...), and
+another share can hang without answering to exercise call deadlines.
+Used by the benchmarks so load tests need no API key and burn no quota.
+
+    import fake_genai, main
+    fake_genai.configure(latency=0.2, tokens=40, token_delay=0.02, error_rate=0.05, hang_rate=0.01)
+    fake_genai.install(main.genai)
+"""
+
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from google.api_core import exceptions
+
+
+class FakeConfig:
+    """Behaviour shared by every fake model; change it with `configure`."""
+
+    latency = 0.2
+    tokens = 1
+    token_delay = 0.0
+    error_rate = 0.0
+    error_codes = (429, 503)
+    hang_rate = 0.0
+    random = random.Random(0)
+    calls = 0
+    errors = 0
+    hangs = 0
+
+
+def configure(seed: int | None = None, **settings) -> None:
+    """Set any FakeConfig attribute, e.g. configure(latency=0.1, error_rate=0.02)."""
+    for name, value in settings.items():
+        if not hasattr(FakeConfig, name):
+            raise AttributeError(f"Unknown fake model setting: {name}")
+        setattr(FakeConfig, name, value)
+    if seed is not None:
+        FakeConfig.random = random.Random(seed)
+
+
+def install(genai_module):
+    """Replace `genai_module.GenerativeModel` with the fake and return the original."""
+    original = genai_module.GenerativeModel
+    genai_module.GenerativeModel = FakeGenerativeModel
+    return original
+
+
+def maybe_fail() -> None:
+    """Raise an injected API error for `error_rate` of calls."""
+    FakeConfig.calls += 1
+    if FakeConfig.error_rate and FakeConfig.random.random() < FakeConfig.error_rate:
+        FakeConfig.errors += 1
+        code = FakeConfig.random.choice(FakeConfig.error_codes)
+        raise exceptions.from_http_status(code, "Injected by fake_genai")
+
+
+async def maybe_hang() -> None:
+    """Never answer for `hang_rate` of calls (until cancelled)."""
+    if FakeConfig.hang_rate and FakeConfig.random.random() < FakeConfig.hang_rate:
+        FakeConfig.hangs += 1
+        await asyncio.Event().wait()
+
+
+def usage(prompt: str, reply_tokens: int):
+    return SimpleNamespace(
+        prompt_token_count=len(prompt) // 4 + 1,
+        candidates_token_count=reply_tokens,
+        cached_content_token_count=0,
+    )
+
+
+class FakeResponse:
+    def __init__(self, text: str, usage_metadata=None):
+        self.text = text
+        self.parts = [text]
+        self.usage_metadata = usage_metadata
+
+
+class FakeStreamResponse:
+    """Yields one chunk per token after the first-token latency."""
+
+    def __init__(self, tokens: list[str], usage_metadata):
+        self.tokens = tokens
+        self.usage_metadata = usage_metadata
+
+    async def __aiter__(self):
+        await asyncio.sleep(FakeConfig.latency)
+        for token in self.tokens:
+            yield FakeResponse(token)
+            await asyncio.sleep(FakeConfig.token_delay)
+
+
+class FakeChatSession:
+    def __init__(self, model: "FakeGenerativeModel", history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def reply_tokens(self, content) -> list[str]:
+        return [f"Echo: {content}"] + [" token"] * (FakeConfig.tokens - 1)
+
+    def send_message(self, content, **kwargs):
+        maybe_fail()
+        time.sleep(FakeConfig.latency + FakeConfig.token_delay * FakeConfig.tokens)
+        return FakeResponse("".join(self.reply_tokens(content)), usage(str(content), FakeConfig.tokens))
+
+    async def send_message_async(self, content, stream=False, **kwargs):
+        maybe_fail()
+        await maybe_hang()
+        tokens = self.reply_tokens(content)
+        if stream:
+            return FakeStreamResponse(tokens, usage(str(content), len(tokens)))
+        await asyncio.sleep(FakeConfig.latency + FakeConfig.token_delay * len(tokens))
+        return FakeResponse("".join(tokens), usage(str(content), len(tokens)))
+
+
+class FakeGenerativeModel:
+    """Stand-in for genai.GenerativeModel."""
+
+    def __init__(self, model_name=None, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    @classmethod
+    def from_cached_content(cls, cached_content, **kwargs):
+        return cls(model_name=getattr(cached_content, "model", None))
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history)
+
+    async def count_tokens_async(self, contents, **kwargs):
+        await asyncio.sleep(FakeConfig.latency)
+        return SimpleNamespace(total_tokens=len(str(contents)) // 4 + 1)
+
+    async def generate_content_async(self, contents, **kwargs):
+        maybe_fail()
+        await maybe_hang()
+        await asyncio.sleep(FakeConfig.latency)
+        return FakeResponse("Summary: " + str(contents)[:200], usage(str(contents), 50))
@@ -0,0 +1,197 @@
+"""
+In-process stand-in for the parts of `redis.asyncio.Redis` the session store uses.
+
+Keys expire like in Redis (checked on access), values come back as bytes, and
+pipelines queue commands until `execute` (with WATCH/MULTI for
+transactions). Used by `bench.py --mode sessions`
+to check the redis backend without a server:
+
+    import fake_redis
+    store = RedisSessionStore(client=fake_redis.FakeRedis())
+"""
+
+import time
+
+try:
+    from redis.exceptions import WatchError
+except ImportError:
+    class WatchError(Exception):
+        """Stand-in for redis.exceptions.WatchError when redis isn't installed."""
+
+
+def as_bytes(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class FakeRedis:
+    """Strings, sorted sets and hashes with key expiry; one logical database."""
+
+    def __init__(self):
+        self._data: dict[bytes, object] = {}
+        self._expires: dict[bytes, float] = {}
+        # key -> number of writes, so pipelines can tell whether a watched key changed
+        self._writes: dict[bytes, int] = {}
+        self.commands = 0
+
+    def _touch(self, key: bytes):
+        self._writes[key] = self._writes.get(key, 0) + 1
+
+    def _get(self, key, kind):
+        key = as_bytes(key)
+        self.commands += 1
+        expires = self._expires.get(key)
+        if expires is not None and time.monotonic() >= expires:
+            del self._data[key], self._expires[key]
+            self._touch(key)
+        value = self._data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _container(self, key, kind):
+        value = self._get(key, kind)
+        if value is None:
+            value = self._data[as_bytes(key)] = kind()
+        return value
+
+    async def get(self, key):
+        return self._get(key, bytes)
+
+    async def set(self, key, value, ex=None):
+        self._get(key, object)
+        key = as_bytes(key)
+        self._data[key] = as_bytes(value)
+        self._touch(key)
+        if ex:
+            self._expires[key] = time.monotonic() + ex
+        else:
+            self._expires.pop(key, None)
+        return True
+
+    async def expire(self, key, seconds):
+        if self._get(key, object) is None:
+            return False
+        self._expires[as_bytes(key)] = time.monotonic() + seconds
+        self._touch(as_bytes(key))
+        return True
+
+    async def delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self._get(key, object) is not None:
+                key = as_bytes(key)
+                del self._data[key]
+                self._expires.pop(key, None)
+                self._touch(key)
+                deleted += 1
+        return deleted
+
+    async def zadd(self, key, mapping: dict, xx=False, ch=False):
+        zset = self._container(key, dict)
+        added = changed = 0
+        for member, score in mapping.items():
+            member = as_bytes(member)
+            if xx and member not in zset:
+                continue
+            added += member not in zset
+            changed += zset.get(member) != float(score)
+            zset[member] = float(score)
+        if not zset:
+            del self._data[as_bytes(key)]
+        return changed if ch else added
+
+    async def zcard(self, key):
+        return len(self._get(key, dict) or {})
+
+    async def zrange(self, key, start, end):
+        members = [m for m, _ in sorted((self._get(key, dict) or {}).items(), key=lambda item: (item[1], item[0]))]
+        end = len(members) + end if end < 0 else end
+        return members[start:end + 1]
+
+    async def zrangebyscore(self, key, low, high):
+        low, high = float(low), float(high)
+        items = sorted((self._get(key, dict) or {}).items(), key=lambda item: (item[1], item[0]))
+        return [m for m, score in items if low <= score <= high]
+
+    async def zrem(self, key, *members):
+        zset = self._get(key, dict) or {}
+        removed = sum(zset.pop(as_bytes(m), None) is not None for m in members)
+        if not zset:
+            self._data.pop(as_bytes(key), None)
+        return removed
+
+    async def hset(self, key, field, value):
+        fields = self._container(key, dict)
+        added = as_bytes(field) not in fields
+        fields[as_bytes(field)] = as_bytes(value)
+        return int(added)
+
+    async def hdel(self, key, *fields):
+        values = self._get(key, dict) or {}
+        removed = sum(values.pop(as_bytes(f), None) is not None for f in fields)
+        if not values:
+            self._data.pop(as_bytes(key), None)
+        return removed
+
+    async def hvals(self, key):
+        return list((self._get(key, dict) or {}).values())
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Queues commands and runs them in order on `execute`.
+
+    After `watch`, commands run immediately (as in redis-py) until `multi`;
+    `execute` then raises WatchError if a watched key was written meanwhile.
+    """
+
+    def __init__(self, client: FakeRedis):
+        self._client = client
+        self._queue: list[tuple[str, tuple, dict]] = []
+        self._watched: dict[bytes, int] = {}
+        self._immediate = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._reset()
+
+    def _reset(self):
+        self._queue.clear()
+        self._watched.clear()
+        self._immediate = False
+
+    async def watch(self, *keys):
+        for key in map(as_bytes, keys):
+            self._watched[key] = self._client._writes.get(key, 0)
+        self._immediate = True
+        return True
+
+    def multi(self):
+        self._immediate = False
+
+    def __getattr__(self, name):
+        if not callable(getattr(FakeRedis, name, None)) or name.startswith("_"):
+            raise AttributeError(name)
+        if self._immediate:
+            return getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._queue.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        queued, watched = list(self._queue), dict(self._watched)
+        self._reset()
+        # Lazy expiry counts as a write, as in Redis
+        for key in watched:
+            self._client._get(key, object)
+        if any(self._client._writes.get(key, 0) != count for key, count in watched.items()):
+            raise WatchError("Watched variable changed.")
+        return [await getattr(self._client, name)(*args, **kwargs) for name, args, kwargs in queued]
@@ -0,0 +1,159 @@
+"""
+Token-budgeted conversation history.
+
+Instead of a fixed number of messages, each turn keeps as many recent messages
+as fit in a token budget. Messages that fall out of the window are folded into
+a running summary by a background task, off the request path, so the prompt
+stays bounded without forgetting what the guest said earlier.
+
+The summary is kept at the front of the stored history as a user/model pair,
+so every session store backend can hold it without schema changes.
+"""
+
+import asyncio
+import logging
+from contextlib import nullcontext
+
+from sessions import SessionConflict
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "[Summary of the conversation so far]\n"
+SUMMARY_ACK = "Understood, I'll keep that in mind."
+
+# Role and turn framing tokens added per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Reload-and-save attempts when another worker saves the session mid-compaction
+SAVE_ATTEMPTS = 3
+
+
+def count_tokens(text: str) -> int:
+    """Approximate Gemini token count (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def message_tokens(message: dict) -> int:
+    return MESSAGE_OVERHEAD_TOKENS + sum(count_tokens(str(part)) for part in message["parts"])
+
+
+def history_tokens(history: list) -> int:
+    return sum(message_tokens(m) for m in history)
+
+
+def summary_messages(summary: str) -> list:
+    return [
+        {"role": "user", "parts": [SUMMARY_PREFIX + summary]},
+        {"role": "model", "parts": [SUMMARY_ACK]},
+    ]
+
+
+def split_summary(history: list) -> tuple[str | None, list]:
+    """Return (summary text or None, the messages after the summary pair)."""
+    if len(history) >= 2 and str(history[0]["parts"][0]).startswith(SUMMARY_PREFIX):
+        return str(history[0]["parts"][0])[len(SUMMARY_PREFIX):], history[2:]
+    return None, history
+
+
+def pinned_messages(history: list) -> int:
+    """How many leading messages hold the summary, for session store trims to keep."""
+    return 2 if split_summary(history)[0] is not None else 0
+
+
+def transcript(messages: list) -> str:
+    return "\n".join(
+        f"{'Guest' if m['role'] == 'user' else 'Assistant'}: {' '.join(str(p) for p in m['parts'])}"
+        for m in messages
+    )
+
+
+class HistoryCompactor:
+    """Fits histories to a token budget and summarizes what falls out of the window.
+
+    `summarize(previous_summary, messages)` is an async callable returning the
+    new summary text; it runs in a background task after the turn is answered.
+    `lock(session_id)`, if given, returns an async context manager held while
+    the summary is written back, so it can't interleave with a turn's save.
+    """
+
+    def __init__(self, store, summarize, budget_tokens: int = 2000, lock=None):
+        self.store = store
+        self.summarize = summarize
+        self.budget_tokens = budget_tokens
+        self.lock = lock or (lambda session_id: nullcontext())
+
+        # session_id -> latest summarization task, so a session's summaries apply in order
+        self._pending: dict[str, asyncio.Task] = {}
+        self.counters = {"compactions": 0, "summarized_messages": 0, "summary_failures": 0}
+
+    def fit(self, history: list) -> tuple[list, list]:
+        """Split the history into (window to send, older messages to summarize).
+
+        The summary pair and the newest message are always kept, and the window
+        after the summary starts with a user message so roles keep alternating.
+        """
+        summary, rest = split_summary(history)
+        pinned = summary_messages(summary) if summary is not None else []
+        if not rest:
+            return pinned, []
+
+        budget = self.budget_tokens - history_tokens(pinned)
+        start = len(rest) - 1
+        used = message_tokens(rest[start])
+        while start > 0:
+            tokens = message_tokens(rest[start - 1])
+            if used + tokens > budget:
+                break
+            used += tokens
+            start -= 1
+        while start < len(rest) - 1 and rest[start]["role"] != "user":
+            start += 1
+        return pinned + rest[start:], rest[:start]
+
+    def compact_later(self, session_id: str, overflow: list) -> None:
+        """Fold `overflow` into the session's stored summary in the background."""
+        if not overflow:
+            return
+        previous = self._pending.get(session_id)
+        task = asyncio.create_task(self._compact(session_id, overflow, previous))
+        self._pending[session_id] = task
+        task.add_done_callback(lambda t: self._pending.pop(session_id, None) if self._pending.get(session_id) is t else None)
+
+    async def drain(self) -> None:
+        """Wait for all pending summaries (used by benchmarks and shutdown)."""
+        while self._pending:
+            await asyncio.wait(list(self._pending.values()))
+
+    async def _compact(self, session_id: str, overflow: list, previous: asyncio.Task | None) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        summary, _ = split_summary(await self.store.load(session_id))
+        try:
+            new_summary = await self.summarize(summary, overflow)
+        except Exception as e:
+            self.counters["summary_failures"] += 1
+            logger.warning("History summary failed for session %s: %s", session_id, e)
+            return
+
+        # Reload so turns answered while summarizing are kept; retry if another worker saves in between
+        async with self.lock(session_id):
+            for _ in range(SAVE_ATTEMPTS):
+                stored, version = await self.store.load_versioned(session_id)
+                if not stored:
+                    return  # reset or expired meanwhile
+                _, rest = split_summary(stored)
+                try:
+                    await self.store.save(session_id, summary_messages(new_summary) + rest, version=version)
+                    break
+                except SessionConflict:
+                    continue
+            else:
+                self.counters["summary_failures"] += 1
+                logger.warning("History summary for session %s not saved: the session kept changing", session_id)
+                return
+        self.counters["compactions"] += 1
+        self.counters["summarized_messages"] += len(overflow)
+
+    def stats(self) -> dict:
+        return {"budget_tokens": self.budget_tokens, "pending": len(self._pending), **self.counters}
@@ -0,0 +1,264 @@
+"""
+Gemini model setup.
+
+The system prompt is uploaded once as server-side cached content and reused by
+every chat turn, so each request only pays full price for its own history and
+message. If caching is unavailable (unsupported model, prompt below the minimum
+cache size, API error) the model falls back to sending the prompt inline.
+
+Models are built once and shared by all requests, and each session keeps its
+chat object between turns so prior messages are not re-converted to protobuf
+`Content` every time.
+
+The SDK itself is imported on first use rather than at startup, so the server
+can answer health checks while it loads.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LazySDK:
+    """`google.generativeai`, imported on first use instead of at module import.
+
+    The SDK pulls in grpc, protobuf and the API discovery client (about a
+    second of imports), which would otherwise delay the app answering /health.
+    Attribute access imports it in place; `PromptCache` imports it off the
+    event loop. `configure` may be called before the import and is applied then.
+    """
+
+    def __init__(self):
+        self._module = None
+        self._options: dict = {}
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def configure(self, **options) -> None:
+        self._options = options
+        if self._module is not None:
+            self._module.configure(**options)
+
+    def load(self):
+        """Import and configure the SDK if needed, and return it."""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    import google.generativeai as module
+                    module.configure(**self._options)
+                    self._module = module
+                    logger.info("Imported google.generativeai in %.2fs", time.perf_counter() - started)
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+genai = LazySDK()
+
+
+def usage_tokens(response) -> dict:
+    """A response's prompt, cached prompt, uncached prompt and output token counts."""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    return {"prompt_tokens": prompt_tokens, "cached_prompt_tokens": cached_tokens,
+            "uncached_prompt_tokens": prompt_tokens - cached_tokens, "output_tokens": output_tokens}
+
+
+class PromptCache:
+    """Cached-content handle for a static system prompt, refreshed before it expires.
+
+    Creating and extending the cache are network calls, so they run in one
+    background task; requests keep using the current cached model until it
+    actually expires, and the inline-prompt model until a cache exists.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        system_prompt: str,
+        enabled: bool = True,
+        ttl_seconds: int = 3600,
+        refresh_margin_seconds: int = 300,
+        retry_after_seconds: int = 600,
+        timeout_seconds: float = 30,
+    ):
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.timeout_seconds = timeout_seconds
+
+        self._cache = None
+        self._cached_model = None
+        self._inline_model = None
+        self._expires_at = 0.0
+        self._retry_at = 0.0
+        self._refreshing: asyncio.Task | None = None
+
+        self.counters = {
+            "requests": 0,
+            "cached_requests": 0,
+            "prompt_tokens": 0,
+            "cached_prompt_tokens": 0,
+            "cache_creates": 0,
+            "cache_refreshes": 0,
+            "cache_failures": 0,
+        }
+
+    async def model(self):
+        """Return a model using the cached prompt, or an inline-prompt model as fallback."""
+        if not genai.loaded:
+            await asyncio.to_thread(genai.load)
+        if self.enabled and time.time() >= self._expires_at - self.refresh_margin_seconds:
+            self.refresh_later()
+
+        if self._cached_model is not None and time.time() < self._expires_at:
+            return self._cached_model
+        return self._inline()
+
+    def refresh_later(self) -> asyncio.Task | None:
+        """Start a background cache refresh unless one is running or failures are backing off.
+
+        Return the running refresh task, if any.
+        """
+        if self._refreshing is None and time.time() >= self._retry_at:
+            self._refreshing = asyncio.create_task(self._refresh())
+            self._refreshing.add_done_callback(self._refreshed)
+        return self._refreshing
+
+    def _refreshed(self, task: asyncio.Task) -> None:
+        if self._refreshing is task:
+            self._refreshing = None
+
+    def _inline(self):
+        if self._inline_model is None:
+            self._inline_model = genai.GenerativeModel(model_name=self.model_name, system_instruction=self.system_prompt)
+        return self._inline_model
+
+    async def warm_up(self, create_cache: bool = True, connect: bool = True, timeout: float = 10) -> None:
+        """Import the SDK and build the model and shared async transport before the first request.
+
+        With `create_cache` False the prompt cache is created in the background
+        once requests arrive.
+        With `connect`, a token count request opens the upstream connection, so
+        the first guest doesn't wait for the TLS handshake either. The async
+        gRPC channel is bound to the running event loop, so this has to run
+        inside it (e.g. from the app's lifespan).
+        """
+        if not genai.loaded:
+            await asyncio.to_thread(genai.load)
+        self._inline()
+        if create_cache and self.enabled:
+            refresh = self.refresh_later()
+            if refresh is not None:
+                await refresh
+        from google.generativeai import client as genai_client
+        genai_client.get_default_generative_async_client()
+        if connect:
+            # A bare model keeps the request tiny; counting tokens is free
+            probe = genai.GenerativeModel(model_name=self.model_name)
+            await asyncio.wait_for(probe.count_tokens_async("Hello"), timeout)
+
+    async def _refresh(self) -> None:
+        now = time.time()
+        try:
+            if self._cache is not None and now < self._expires_at:
+                # Still alive: extending the TTL is cheaper than re-uploading the prompt
+                await asyncio.wait_for(asyncio.to_thread(self._cache.update, ttl=self.ttl_seconds),
+                                       self.timeout_seconds)
+                self.counters["cache_refreshes"] += 1
+            else:
+                self._cache = await asyncio.wait_for(asyncio.to_thread(
+                    genai.caching.CachedContent.create,
+                    model=self.model_name,
+                    system_instruction=self.system_prompt,
+                    ttl=self.ttl_seconds,
+                ), self.timeout_seconds)
+                self._cached_model = genai.GenerativeModel.from_cached_content(self._cache)
+                self.counters["cache_creates"] += 1
+            self._expires_at = now + self.ttl_seconds
+        except Exception as e:
+            self.counters["cache_failures"] += 1
+            self._retry_at = now + self.retry_after_seconds
+            logger.warning("Prompt caching unavailable, sending system prompt inline: %r", e)
+
+    def record_usage(self, response) -> dict:
+        """Add one response's prompt token usage to the counters and return its token counts."""
+        tokens = usage_tokens(response)
+        self.counters["requests"] += 1
+        self.counters["cached_requests"] += bool(tokens["cached_prompt_tokens"])
+        self.counters["prompt_tokens"] += tokens["prompt_tokens"]
+        self.counters["cached_prompt_tokens"] += tokens["cached_prompt_tokens"]
+        logger.debug("Prompt token usage: %s", tokens)
+        return tokens
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "active": self._cached_model is not None and time.time() < self._expires_at,
+            "cache_name": getattr(self._cache, "name", None),
+            "uncached_prompt_tokens": self.counters["prompt_tokens"] - self.counters["cached_prompt_tokens"],
+            **self.counters,
+        }
+
+
+class ChatSessionCache:
+    """Keeps each session's Gemini chat object between turns.
+
+    A cached chat is reused when its messages end with the history the turn was
+    started from (the session store may have trimmed older messages since), so
+    only the new message is converted. Anything else rebuilds the chat.
+    """
+
+    def __init__(self, max_sessions: int = 1000):
+        self.max_sessions = max_sessions
+        # session_id -> (chat session, history dicts it was built from), oldest first
+        self._chats: OrderedDict[str, tuple[object, list]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def checkout(self, session_id: str, model, history: list):
+        """Return a chat primed with all but the last (current) message of `history`.
+
+        The chat is removed from the cache until `checkin`, so two concurrent
+        turns for the same session never share one.
+        """
+        prior = history[:-1]
+        entry = self._chats.pop(session_id, None)
+        if entry is not None:
+            chat, messages = entry
+            start = len(messages) - len(prior)
+            if start >= 0 and messages[start:] == prior:
+                chat.model = model
+                if start:
+                    chat.history = chat.history[start:]
+                self.hits += 1
+                return chat
+        self.misses += 1
+        return model.start_chat(history=prior)
+
+    def checkin(self, session_id: str, chat, history: list) -> None:
+        """Keep `chat` for the session's next turn; `history` must include the reply."""
+        self._chats[session_id] = (chat, list(history))
+        self._chats.move_to_end(session_id)
+        while len(self._chats) > self.max_sessions:
+            self._chats.popitem(last=False)
+
+    def discard(self, session_id: str) -> None:
+        self._chats.pop(session_id, None)
+
+    def stats(self) -> dict:
+        return {"cached_chats": len(self._chats), "hits": self.hits, "misses": self.misses}
@@ -3,18 +3,51 @@ Seattle Marriott Bellevue - Customer Support Chatbot Demo
 A simple FastAPI server with Google Gemini integration.
 """
 
+import asyncio
+import json
+import logging
+import math
 import os
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+import secrets
+import time
+from contextlib import asynccontextmanager, nullcontext
+from pathlib import Path
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-import google.generativeai as genai
 from dotenv import load_dotenv
 
+from catalog import Catalog, FastPathEngine
+from history import HistoryCompactor, pinned_messages, transcript
+from llm import ChatSessionCache, PromptCache, genai, usage_tokens
+from metrics import LatencyTracker, MetricsMiddleware, MetricsRegistry, StageTimer, annotate
+from replay import Replayer, parse_conversations
+from resilience import CircuitBreaker, CircuitOpen, ModelCallGuard, Overloaded, is_retryable
+from response_cache import ResponseCache
+from sessions import SessionConflict, create_session_store
+from static_assets import StaticAssets
+from turns import SessionBusy, TurnCoordinator
+
 load_dotenv()
 
-app = FastAPI(title="Marriott Bellevue Chatbot")
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve /health at once; import the SDK and warm the model path in the background (see /ready)
+    task = asyncio.create_task(warm_up()) if WARM_UP else None
+    yield
+    if task is not None:
+        task.cancel()
 
-# Configure Gemini
+
+app = FastAPI(title="Marriott Bellevue Chatbot", lifespan=lifespan)
+
+# Configure Gemini (applied when the SDK is first imported)
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 # Hotel information embedded in system prompt
@@ -330,8 +363,174 @@ IMPORTANT: Always de-escalate. Never be defensive. The guest's comfort is the pr
 
 Remember: This is a demo, so simulate confirmations and completions appropriately."""
 
-# Store conversation history per session (in-memory for demo)
-conversations: dict[str, list] = {}
+# Store conversation history per session, bounded by TTL, LRU cap and per-session budgets.
+# Use the sqlite or redis backend to share sessions between workers.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_BACKEND_OPTIONS = {
+    "memory": {},
+    "sqlite": {"path": os.getenv("SESSION_DB_PATH", "sessions.db")},
+    "redis": {"url": os.getenv("REDIS_URL", "redis://localhost:6379/0")},
+}
+sessions = create_session_store(
+    SESSION_BACKEND,
+    ttl_seconds=float(os.getenv("SESSION_TTL_SECONDS", 3600)),
+    max_sessions=int(os.getenv("MAX_SESSIONS", 10000)),
+    max_messages=int(os.getenv("SESSION_MAX_MESSAGES", 0)) or None,
+    max_bytes=int(os.getenv("SESSION_MAX_BYTES", 64 * 1024)),
+    pinned=pinned_messages,
+    **SESSION_BACKEND_OPTIONS.get(SESSION_BACKEND, {}),
+)
+
+MODEL_NAME = "gemini-2.5-flash-lite"
+
+# Upload SYSTEM_PROMPT once as cached content instead of re-sending it every turn
+prompt_cache = PromptCache(
+    MODEL_NAME,
+    SYSTEM_PROMPT,
+    enabled=os.getenv("PROMPT_CACHE", "1") != "0",
+    ttl_seconds=int(os.getenv("PROMPT_CACHE_TTL_SECONDS", 3600)),
+)
+
+# Per-session chat objects kept between turns so only the new message is serialized
+chat_sessions = ChatSessionCache(max_sessions=int(os.getenv("MAX_CACHED_CHATS", 1000)))
+
+SUMMARY_INSTRUCTION = """Summarize this hotel guest conversation for the assistant that will continue it.
+Keep the guest's name, room number, reservation details, orders, complaints and anything promised to them.
+Use plain text, under 120 words."""
+summary_model = None
+
+
+async def summarize_history(previous_summary: str | None, messages: list, guard: ModelCallGuard | None = None) -> str:
+    """Fold older messages into the running conversation summary (through `guard`, default the live one)."""
+    global summary_model
+    if summary_model is None:
+        summary_model = genai.GenerativeModel(model_name=MODEL_NAME, system_instruction=SUMMARY_INSTRUCTION)
+    text = transcript(messages)
+    if previous_summary:
+        text = f"Earlier summary: {previous_summary}\n\n{text}"
+    # Calls through another guard (batch replays) stay off the live in-flight gauge
+    in_flight = model_calls_in_flight.track() if guard is None else nullcontext()
+    guard = guard or model_guard
+    async with guard.slot():
+        with in_flight:
+            response = await guard.call(lambda: summary_model.generate_content_async(text))
+    return response.text
+
+
+# One turn at a time per session; repeats of a message being answered share its reply
+turns = TurnCoordinator(
+    dedup_seconds=float(os.getenv("DEDUP_WINDOW_SECONDS", 2)),
+    max_pending=int(os.getenv("MAX_PENDING_TURNS", 4)),
+)
+
+# Keep as many recent messages as fit the token budget; summarize the rest off the request path
+history_compactor = HistoryCompactor(
+    sessions,
+    summarize_history,
+    budget_tokens=int(os.getenv("HISTORY_TOKEN_BUDGET", 2000)),
+    lock=lambda session_id: turns.serialized(session_id, bounded=False),
+)
+
+# Replies to first-turn questions, keyed on the question and a hash of SYSTEM_PROMPT
+response_cache = ResponseCache(
+    SYSTEM_PROMPT,
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 3600)),
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000)),
+    similarity=float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0)),
+)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") != "0"
+
+# Menu, prices and hours parsed from SYSTEM_PROMPT; answers simple lookups without the model
+fast_path = FastPathEngine(Catalog.from_prompt(SYSTEM_PROMPT)) if os.getenv("FAST_PATH", "1") != "0" else None
+
+# End-to-end /chat latency by which path produced the reply: fast_path, response_cache or model
+path_latency = LatencyTracker()
+
+# Prometheus metrics served on /metrics
+metrics = MetricsRegistry()
+http_requests = metrics.counter(
+    "chatbot_http_requests_total", "HTTP requests by method, route and status", ("method", "route", "status"))
+http_request_seconds = metrics.histogram(
+    "chatbot_http_request_duration_seconds", "HTTP request latency by method and route", ("method", "route"))
+chat_stage_seconds = metrics.histogram(
+    "chatbot_chat_stage_duration_seconds", "Time spent in each stage of a chat turn", ("stage",))
+model_tokens = metrics.counter(
+    "chatbot_model_tokens_total", "Gemini tokens from response usage metadata", ("kind",))
+active_sessions = metrics.gauge("chatbot_active_sessions", "Sessions held by the session store")
+model_calls_in_flight = metrics.gauge("chatbot_model_calls_in_flight", "Gemini calls currently running")
+errors = metrics.counter("chatbot_errors_total", "Errors by route and exception class", ("route", "exception"))
+model_call_events = metrics.counter(
+    "chatbot_model_call_events_total", "Model call attempts, retries, timeouts and rejections", ("event",))
+degraded_replies = metrics.counter(
+    "chatbot_degraded_replies_total", "Canned replies served because the model was unavailable", ("reason",))
+circuit_open = metrics.gauge("chatbot_model_circuit_open", "1 while model calls are paused by the circuit breaker")
+timed = StageTimer(chat_stage_seconds)
+
+# With TRACE_LOG=1, log one JSON line per request with its id and stage timings
+trace_logger = None
+if os.getenv("TRACE_LOG", "0") != "0":
+    trace_logger = logging.getLogger("chatbot.trace")
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.addHandler(logging.StreamHandler())
+    trace_logger.propagate = False
+
+app.add_middleware(
+    MetricsMiddleware,
+    requests_total=http_requests,
+    request_seconds=http_request_seconds,
+    errors_total=errors,
+    trace_logger=trace_logger,
+)
+
+# Every Gemini call goes through this guard: bounded concurrency and queueing (extra calls are
+# rejected at once), per-attempt timeouts, jittered retries on 429/503 and a circuit breaker
+model_guard = ModelCallGuard(
+    max_concurrent=int(os.getenv("MAX_CONCURRENT_MODEL_CALLS", 32)),
+    max_queued=int(os.getenv("MAX_QUEUED_MODEL_CALLS", 64)),
+    queue_timeout=float(os.getenv("MODEL_QUEUE_TIMEOUT_SECONDS", 10)),
+    max_per_session=int(os.getenv("MAX_SESSION_MODEL_CALLS", 2)),
+    attempt_timeout=float(os.getenv("MODEL_ATTEMPT_TIMEOUT_SECONDS", 20)),
+    deadline=float(os.getenv("MODEL_CALL_DEADLINE_SECONDS", 40)),
+    retries=int(os.getenv("MODEL_CALL_RETRIES", 2)),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5)),
+        reset_seconds=float(os.getenv("CIRCUIT_RESET_SECONDS", 30)),
+    ),
+    events=model_call_events,
+)
+
+# Startup warm-up of the model path: SDK import, model, transport, prompt cache and upstream connection
+WARM_UP = os.getenv("WARM_UP", "1") != "0"
+WARM_UP_PROMPT_CACHE = os.getenv("WARM_UP_PROMPT_CACHE", "1") != "0"
+warm_up_state = {"status": "pending" if WARM_UP else "skipped", "seconds": None, "error": None}
+
+# Chat page, CSS and JS read and compressed once, served from memory with cache validators
+ui_assets = StaticAssets(BASE_DIR)
+
+# Served instead of an error while Gemini is rate limiting us or unavailable
+DEGRADED_REPLY = ("I'm sorry, I'm having trouble answering right now. Please try again in a moment, "
+                  "or call the front desk at (425) 214-7600 and we'll be happy to help.")
+
+
+async def warm_up() -> None:
+    """Warm the model path in the background, retrying with backoff until it succeeds."""
+    if not os.getenv("GEMINI_API_KEY"):
+        warm_up_state.update(status="failed", error="Gemini API key not configured")
+        return
+    warm_up_state["status"] = "warming"
+    started = time.perf_counter()
+    delay = 1.0
+    while True:
+        try:
+            await prompt_cache.warm_up(create_cache=WARM_UP_PROMPT_CACHE)
+            break
+        except Exception as e:
+            warm_up_state["error"] = f"{type(e).__name__}: {e}"
+            logger.warning("Model warm-up failed, retrying in %.0fs: %s", delay, e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+    warm_up_state.update(status="ready", seconds=round(time.perf_counter() - started, 3), error=None)
+    logger.info("Model path warm after %.2fs", warm_up_state["seconds"])
 
 
 class ChatRequest(BaseModel):
@@ -344,74 +543,437 @@ class ChatResponse(BaseModel):
     session_id: str
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """Process a chat message and return AI response."""
-    
+def require_api_key() -> None:
     if not os.getenv("GEMINI_API_KEY"):
         raise HTTPException(status_code=500, detail="Gemini API key not configured")
+
+
+SAVE_ATTEMPTS = 3
+
+
+async def start_turn(request: ChatRequest) -> tuple[list, list, str]:
+    """Return (history window with the user's message appended, older messages to summarize, version).
     
-    # Get or create conversation history
-    if request.session_id not in conversations:
-        conversations[request.session_id] = []
+    Pass all three to `finish_turn` once the model has replied. Hold the
+    session's turn lock from here until `finish_turn` is done.
+    """
     
-    history = conversations[request.session_id]
+    history, version = await sessions.load_versioned(request.session_id)
     
-    # Add user message to history
+    # Add user message to history, fitted to the token budget
     history.append({"role": "user", "parts": [request.message]})
+    return *history_compactor.fit(history), version
+
+
+async def finish_turn(session_id: str, history: list, reply: str, overflow: list, version: str) -> None:
+    """Save the turn's history with the reply and summarize any overflow in the background.
+    
+    The turn lock only orders turns within this worker. If another worker
+    saved the session since `start_turn`, append this turn to its history
+    instead of overwriting it.
+    """
+    history.append({"role": "model", "parts": [reply]})
+    turn = history[-2:]
+    saving = history
+    for _ in range(SAVE_ATTEMPTS):
+        try:
+            await sessions.save(session_id, saving, version=version)
+            break
+        except SessionConflict:
+            latest, version = await sessions.load_versioned(session_id)
+            saving, overflow = latest + turn, []
+    else:
+        logger.warning("Session %s kept changing during save; saving this turn over it", session_id)
+        await sessions.save(session_id, saving)
+    history_compactor.compact_later(session_id, overflow)
+
+
+async def start_chat_session(session_id: str, history: list):
+    """Get a Gemini chat session primed with all but the current message.
+    
+    Return it with `chat_sessions.checkin` once the turn succeeds.
+    """
+    with timed("model_setup"):
+        model = await prompt_cache.model()
+    with timed("chat_setup"):
+        return chat_sessions.checkout(session_id, model, history)
+
+
+def cacheable(history: list, overflow: list) -> bool:
+    """Only first-turn questions are answered from the response cache."""
+    return RESPONSE_CACHE_ENABLED and len(history) == 1 and not overflow
+
+
+def local_reply(message: str, history: list, overflow: list) -> tuple[str | None, str | None]:
+    """Return (reply, path) when the fast path or response cache can answer, else (None, None)."""
+    if fast_path is not None:
+        reply = fast_path.answer(message, first_turn=len(history) == 1)
+        if reply is not None:
+            return reply, "fast_path"
+    if cacheable(history, overflow):
+        reply = response_cache.get(message)
+        if reply is not None:
+            return reply, "response_cache"
+    return None, None
+
+
+def count_usage(response) -> dict:
+    """Count the response's prompt, cached prompt and output tokens and return them."""
+    tokens = prompt_cache.record_usage(response)
+    for kind in ("uncached_prompt", "cached_prompt", "output"):
+        model_tokens.inc(tokens[f"{kind}_tokens"], kind=kind)
+    return tokens
+
+
+def record_usage(response) -> None:
+    """Count the response's tokens and add them to the request's trace."""
+    annotate(tokens=count_usage(response))
+
+
+def record_path(path: str, received: float) -> None:
+    """Record which path answered the turn and its end-to-end latency."""
+    path_latency.record(path, time.perf_counter() - received)
+    annotate(path=path)
+
+
+def chat_response(reply: str, session_id: str) -> Response:
+    """Serialize the reply here rather than in FastAPI, so it is timed as the `serialize` stage."""
+    with timed("serialize"):
+        body = ChatResponse(response=reply, session_id=session_id).model_dump_json()
+    return Response(body, media_type="application/json")
+
+
+def fallback_reply(e: Exception) -> str | None:
+    """The canned reply when the upstream is unhealthy (breaker open, retries exhausted), else None."""
+    if isinstance(e, CircuitOpen) or is_retryable(e):
+        degraded_replies.inc(reason=type(e).__name__)
+        return DEGRADED_REPLY
+    return None
+
+
+def failure_detail(e: Exception) -> dict:
+    """Error body for a failed model call, without leaking upstream exception text."""
+    if isinstance(e, Overloaded):
+        return {"detail": str(e), "retry_after": e.retry_after}
+    logger.error("Model call failed: %r", e)
+    return {"detail": "The assistant could not answer, please try again"}
+
+
+def sse_event(data: dict, event: str = "message") -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def answer(request: ChatRequest, received: float) -> str:
+    """Answer one turn and return the reply; the session's turn lock must be held."""
+    with timed("history"):
+        history, overflow, version = await start_turn(request)
     
-    # Keep only last 20 messages to manage context length
-    if len(history) > 20:
-        history = history[-20:]
-        conversations[request.session_id] = history
+    with timed("local_reply"):
+        reply, path = local_reply(request.message, history, overflow)
+    if reply is not None:
+        with timed("save"):
+            await finish_turn(request.session_id, history, reply, overflow, version)
+        record_path(path, received)
+        return reply
     
     try:
-        # Initialize Gemini model
-        model = genai.GenerativeModel(
-            model_name="gemini-2.5-flash-lite",
-            system_instruction=SYSTEM_PROMPT
-        )
-        
-        # Start chat with history
-        chat_session = model.start_chat(history=history[:-1])  # Exclude current message
+        chat_session = await start_chat_session(request.session_id, history)
         
-        # Send current message
-        response = chat_session.send_message(request.message)
+        # Send current message without blocking the event loop
+        started = time.perf_counter()
+        async with model_guard.slot(request.session_id):
+            with timed("generation"), model_calls_in_flight.track():
+                response = await model_guard.call(lambda: chat_session.send_message_async(request.message))
         
         assistant_message = response.text
+        record_usage(response)
+        if cacheable(history, overflow):
+            response_cache.put(request.message, assistant_message, time.perf_counter() - started)
         
         # Add assistant response to history
-        history.append({"role": "model", "parts": [assistant_message]})
+        with timed("save"):
+            await finish_turn(request.session_id, history, assistant_message, overflow, version)
+            chat_sessions.checkin(request.session_id, chat_session, history)
+        record_path("model", received)
         
-        return ChatResponse(
-            response=assistant_message,
-            session_id=request.session_id
-        )
+        return assistant_message
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        errors.inc(route="/chat", exception=type(e).__name__)
+        reply = fallback_reply(e)
+        if reply is not None:
+            return reply
+        if isinstance(e, Overloaded):
+            raise HTTPException(status_code=503, detail=str(e),
+                                headers={"Retry-After": str(math.ceil(e.retry_after))})
+        raise HTTPException(status_code=500, detail=failure_detail(e)["detail"])
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    """Process a chat message and return AI response.
+    
+    A session's turns are answered one at a time, in order. Resending a
+    message that is still being answered (or was answered moments ago) returns
+    the same reply instead of asking the model again.
+    """
+    received = time.perf_counter()
+    annotate(session_id=request.session_id)
+    require_api_key()
+    
+    reply = await turns.joined(request.session_id, request.message)
+    if reply is not None:
+        record_path("deduplicated", received)
+        return chat_response(reply, request.session_id)
+    
+    turn = turns.claim(request.session_id, request.message)
+    try:
+        async with turns.serialized(request.session_id):
+            reply = await answer(request, received)
+        turn.resolve(reply)
+    except SessionBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    finally:
+        turn.release()
+    return chat_response(reply, request.session_id)
+
+
+async def stream_turn(request: ChatRequest, received: float, turn, emit) -> None:
+    """Answer one turn under the session's turn lock, passing SSE events to `emit`.
+    
+    Runs as its own task, so the turn is completed and saved even if the
+    client disconnects mid-stream. Ends by emitting None.
+    """
+    try:
+        async with turns.serialized(request.session_id):
+            with timed("history"):
+                history, overflow, version = await start_turn(request)
+            with timed("local_reply"):
+                reply, path = local_reply(request.message, history, overflow)
+            if reply is not None:
+                with timed("save"):
+                    await finish_turn(request.session_id, history, reply, overflow, version)
+                record_path(path, received)
+                emit(sse_event({"text": reply}))
+                emit(sse_event({"session_id": request.session_id}, event="done"))
+                turn.resolve(reply)
+                return
+            
+            chunks = []
+            try:
+                chat_session = await start_chat_session(request.session_id, history)
+                started = time.perf_counter()
+                async with model_guard.slot(request.session_id):
+                    with timed("generation"), model_calls_in_flight.track():
+                        response = await model_guard.call(
+                            lambda: chat_session.send_message_async(request.message, stream=True))
+                        async for chunk in model_guard.iterate(response):
+                            if not chunk.parts:
+                                continue
+                            chunks.append(chunk.text)
+                            emit(sse_event({"text": chunk.text}))
+                record_usage(response)
+            except Exception as e:
+                errors.inc(route="/chat/stream", exception=type(e).__name__)
+                # Once part of a reply is out, a canned reply can't replace it
+                fallback = None if chunks else fallback_reply(e)
+                if fallback is not None:
+                    emit(sse_event({"text": fallback}))
+                    emit(sse_event({"session_id": request.session_id, "degraded": True}, event="done"))
+                    turn.resolve(fallback)
+                else:
+                    emit(sse_event(failure_detail(e), event="error"))
+                return
+            
+            # Add the complete assistant response to history
+            assistant_message = "".join(chunks)
+            if cacheable(history, overflow):
+                response_cache.put(request.message, assistant_message, time.perf_counter() - started)
+            with timed("save"):
+                await finish_turn(request.session_id, history, assistant_message, overflow, version)
+                chat_sessions.checkin(request.session_id, chat_session, history)
+            record_path("model", received)
+            emit(sse_event({"session_id": request.session_id}, event="done"))
+            turn.resolve(assistant_message)
+    except SessionBusy as e:
+        emit(sse_event({"detail": str(e), "retry_after": 1}, event="error"))
+    except Exception as e:
+        errors.inc(route="/chat/stream", exception=type(e).__name__)
+        emit(sse_event(failure_detail(e), event="error"))
+    finally:
+        turn.release()
+        emit(None)
+
+
+# Running streamed turns; referenced here so they aren't garbage collected mid-turn
+stream_tasks: set[asyncio.Task] = set()
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Process a chat message and stream the AI response as Server-Sent Events.
+    
+    Emits `message` events with `{"text": ...}` chunks as they are generated,
+    then a single `done` event (or `error` event if generation fails). While
+    the model is unavailable the text is a canned reply and `done` carries
+    `"degraded": true`. Turns are ordered and de-duplicated per session like
+    /chat; a duplicate gets the shared reply as a single `message` event.
+    """
+    received = time.perf_counter()
+    annotate(session_id=request.session_id)
+    require_api_key()
+    
+    reply = await turns.joined(request.session_id, request.message)
+    if reply is not None:
+        record_path("deduplicated", received)
+        events = iter([
+            sse_event({"text": reply}),
+            sse_event({"session_id": request.session_id}, event="done"),
+        ])
+    else:
+        queue = asyncio.Queue()
+        turn = turns.claim(request.session_id, request.message)
+        task = asyncio.create_task(stream_turn(request, received, turn, queue.put_nowait))
+        stream_tasks.add(task)
+        task.add_done_callback(stream_tasks.discard)
+        
+        async def drain():
+            while (event := await queue.get()) is not None:
+                yield event
+        events = drain()
+    
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.post("/reset")
 async def reset_conversation(session_id: str = "default"):
-    """Reset conversation history for a session."""
-    if session_id in conversations:
-        del conversations[session_id]
+    """Reset conversation history for a session (after any turn in progress)."""
+    async with turns.serialized(session_id, bounded=False):
+        await sessions.delete(session_id)
+        chat_sessions.discard(session_id)
+    turns.forget(session_id)
     return {"message": "Conversation reset", "session_id": session_id}
 
 
+# Batch replays of recorded conversations (see replay.py), with their own histories but the
+# live prompt and history budget; the endpoint is off unless a token is set
+BATCH_API_TOKEN = os.getenv("BATCH_API_TOKEN", "")
+MAX_BATCH_WORKERS = int(os.getenv("MAX_BATCH_WORKERS", 8))
+
+# Replays get their own call slots and circuit breaker, so a large or failing replay can't
+# take live traffic's slots or open the breaker guests depend on
+replay_guard = ModelCallGuard(
+    max_concurrent=MAX_BATCH_WORKERS,
+    max_queued=MAX_BATCH_WORKERS * 4,
+    queue_timeout=model_guard.deadline,
+    attempt_timeout=model_guard.attempt_timeout,
+    deadline=model_guard.deadline,
+    retries=model_guard.retries,
+    breaker=CircuitBreaker(
+        failure_threshold=model_guard.breaker.failure_threshold,
+        reset_seconds=model_guard.breaker.reset_seconds,
+    ),
+)
+replay_compactor = HistoryCompactor(
+    None,  # replays keep histories in memory; only fit and summarize are used
+    lambda previous_summary, messages: summarize_history(previous_summary, messages, guard=replay_guard),
+    budget_tokens=history_compactor.budget_tokens,
+)
+# Token counts go in the replay's records only, not the live prompt cache counters or token metrics
+replayer = Replayer(prompt_cache, replay_guard, replay_compactor, fast_path=fast_path, record_usage=usage_tokens)
+
+
+@app.post("/batch/replay")
+async def batch_replay(request: Request, workers: int = 4):
+    """Replay the JSONL conversations in the request body and stream JSONL results.
+    
+    Each conversation gets its own history; live sessions and caches are not
+    touched. One line per answered turn (reply, latency, token usage), then a
+    summary line per conversation. Requires `Authorization: Bearer
+    $BATCH_API_TOKEN`. See replay.py for the formats and the resumable CLI.
+    """
+    if not BATCH_API_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {BATCH_API_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid batch API token")
+    require_api_key()
+    
+    try:
+        conversations = parse_conversations((await request.body()).decode().splitlines())
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def lines():
+        async for record in replayer.run(conversations, workers=max(1, min(workers, MAX_BATCH_WORKERS))):
+            yield json.dumps(record) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Serve the chat interface."""
-    return FileResponse("index.html")
+    return ui_assets.response("index.html", request)
+
+
+@app.get("/static/{name}")
+async def static_file(name: str, request: Request):
+    """Serve the chat interface's CSS and JavaScript."""
+    response = ui_assets.response(name, request)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return response
 
 
 @app.get("/health")
 async def health():
-    """Health check endpoint."""
+    """Health check endpoint (liveness: answers as soon as the server is up)."""
     return {"status": "ok", "hotel": "Seattle Marriott Bellevue"}
 
 
+@app.get("/ready")
+async def ready():
+    """Readiness check: 200 once the model path is warm (or warm-up is disabled), else 503."""
+    ok = warm_up_state["status"] in ("ready", "skipped")
+    return JSONResponse({**warm_up_state, "sdk_loaded": genai.loaded}, status_code=200 if ok else 503)
+
+
+@app.get("/stats")
+async def stats():
+    """Runtime counters for the session store and the prompt, chat object and response caches."""
+    return {
+        "sessions": await sessions.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "chat_sessions": chat_sessions.stats(),
+        "response_cache": response_cache.stats(),
+        "history": history_compactor.stats(),
+        "turns": turns.stats(),
+        "model_calls": model_guard.stats(),
+        "replay_model_calls": replay_guard.stats(),
+        "paths": path_latency.stats(),
+        "offloaded_ratio": offloaded_ratio(),
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Request, stage, token, session and error metrics in the Prometheus text format."""
+    active_sessions.set((await sessions.stats())["live_sessions"])
+    circuit_open.set(int(model_guard.breaker.state != "closed"))
+    return Response(metrics.render(), media_type=metrics.content_type)
+
+
+def offloaded_ratio() -> float:
+    """Share of answered turns that did not need a model call."""
+    total = sum(path_latency.counts.values())
+    return round(1 - path_latency.counts["model"] / total, 4) if total else 0.0
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
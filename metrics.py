@@ -0,0 +1,280 @@
+"""
+In-process request metrics.
+
+Counters, gauges and histograms are rendered in the Prometheus text format by
+`MetricsRegistry.render`, so /metrics needs no client library. Each request
+can also carry a trace (request id plus per-stage timings) that
+`MetricsMiddleware` logs as one JSON line when it completes.
+"""
+
+import json
+import logging
+import math
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Prometheus' default buckets, plus 30 s for slow model calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Trace of the request being handled: {"request_id": ..., "stages": {...}, ...}
+current_trace: ContextVar[dict | None] = ContextVar("current_trace", default=None)
+
+
+class LatencyTracker:
+    """Request counts and rolling latency percentiles per label (e.g. which path answered)."""
+
+    def __init__(self, max_samples: int = 2048):
+        self.counts: defaultdict[str, int] = defaultdict(int)
+        self._samples: defaultdict[str, deque] = defaultdict(lambda: deque(maxlen=max_samples))
+
+    def record(self, label: str, seconds: float) -> None:
+        self.counts[label] += 1
+        self._samples[label].append(seconds)
+
+    def percentile(self, label: str, q: float) -> float:
+        samples = sorted(self._samples[label])
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, math.ceil(q * len(samples)) - 1)]
+
+    def stats(self) -> dict:
+        return {
+            label: {
+                "count": self.counts[label],
+                "p50_ms": round(self.percentile(label, 0.50) * 1000, 3),
+                "p99_ms": round(self.percentile(label, 0.99) * 1000, 3),
+            }
+            for label in self.counts
+        }
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: defaultdict[tuple, float] = defaultdict(float)
+        if not self.labelnames:
+            self._values[()] = 0.0
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        self._values[self._key(labels)] += amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the block as in progress while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> (per-bucket counts, sum, count)
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = format_labels(self.labelnames, key, f'le="{format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Creates metrics and renders all of them for a /metrics endpoint."""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics)
+
+    def _register(self, metric: Metric):
+        self._metrics.append(metric)
+        return metric
+
+
+class StageTimer:
+    """Times named stages of a request into a histogram and the current trace.
+
+        timed = StageTimer(stage_seconds)
+        with timed("generation"):
+            ...
+    """
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    @contextmanager
+    def __call__(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.histogram.observe(elapsed, stage=stage)
+            trace = current_trace.get()
+            if trace is not None:
+                trace["stages"][stage] = round(trace["stages"].get(stage, 0.0) + elapsed * 1000, 3)
+
+
+def annotate(**fields) -> None:
+    """Add fields (session id, answer path, token counts...) to the current request's trace."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.update(fields)
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing every HTTP request by route template.
+
+    Streaming responses are timed until their last body chunk is sent. Each
+    request gets an id (the client's X-Request-ID, or a new one) echoed in the
+    response headers; with a `trace_logger`, one JSON line is logged per request.
+    """
+
+    def __init__(self, app, requests_total: Counter, request_seconds: Histogram, errors_total: Counter,
+                 trace_logger: logging.Logger | None = None):
+        self.app = app
+        self.requests_total = requests_total
+        self.request_seconds = request_seconds
+        self.errors_total = errors_total
+        self.trace_logger = trace_logger
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        trace = {"request_id": request_id, "stages": {}}
+        token = current_trace.set(trace)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        except Exception as e:
+            self.errors_total.inc(route=self._route(scope), exception=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            route = self._route(scope)
+            self.requests_total.inc(method=scope["method"], route=route, status=status)
+            self.request_seconds.observe(elapsed, method=scope["method"], route=route)
+            if self.trace_logger is not None:
+                self.trace_logger.info(json.dumps({
+                    **trace,
+                    "method": scope["method"],
+                    "route": route,
+                    "status": status,
+                    "duration_ms": round(elapsed * 1000, 3),
+                }))
+            current_trace.reset(token)
+
+    @staticmethod
+    def _route(scope) -> str:
+        # The route template, not the raw path, so unknown URLs can't blow up label cardinality
+        route = scope.get("route")
+        return getattr(route, "path", "unmatched")
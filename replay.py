@@ -0,0 +1,344 @@
+"""
+Batch replay of recorded guest conversations, e.g. to regression-test a prompt change.
+
+Each conversation is replayed turn by turn with its own history (no shared
+session store, reply cache or turn de-duplication), several conversations at
+a time, and one JSON line is written per turn as soon as it is answered:
+
+    {"conversation": "guest-042", "turn": 1, "message": "...", "reply": "...", "path": "model",
+     "latency_ms": 812.4, "history_tokens": 31, "tokens": {"prompt_tokens": 1290, ...}}
+
+followed by one summary line when the conversation is finished:
+
+    {"conversation": "guest-042", "done": true, "turns": 2, "errors": 0, "latency_ms": 1630.2, ...}
+
+Input is JSONL, one conversation per line, either a list of guest turns or a
+recorded transcript (guest turns are replayed, recorded replies are kept as
+`expected` next to the new ones):
+
+    {"id": "guest-042", "turns": ["Hi, I'm in room 1214", "What time is checkout?"]}
+    {"id": "guest-043", "turns": [{"message": "Hi", "expected": "Hello!"}]}
+    {"id": "guest-044", "messages": [{"role": "user", "parts": ["Hi"]}, {"role": "model", "parts": ["Hello!"]}]}
+
+An interrupted run is resumed by running the same command again: conversations
+with a summary line in the output file are skipped and the lines of
+unfinished ones are dropped and replayed.
+
+Usage:
+    python replay.py fixtures/guest_conversations.jsonl -o results.jsonl --workers 8
+    python replay.py fixtures/guest_conversations.jsonl -o results.jsonl --fake --latency 0.2
+    python replay.py fixtures/guest_conversations.jsonl -o results.jsonl --prompt new_prompt.txt
+    python replay.py fixtures/guest_conversations.jsonl -o results.jsonl --url https://chatbot.example.com
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterable
+
+from history import history_tokens, split_summary, summary_messages
+
+
+@dataclass
+class Conversation:
+    id: str
+    turns: list[str]
+    # Recorded reply per turn, when replaying a transcript
+    expected: list[str | None] = field(default_factory=list)
+
+
+def parse_conversation(record: dict, index: int) -> Conversation:
+    conversation_id = str(record.get("id", index))
+    if "turns" in record:
+        turns = [turn if isinstance(turn, str) else turn["message"] for turn in record["turns"]]
+        expected = [None if isinstance(turn, str) else turn.get("expected") for turn in record["turns"]]
+        return Conversation(conversation_id, turns, expected)
+    if "messages" in record:
+        turns, expected = [], []
+        for message in record["messages"]:
+            text = " ".join(str(part) for part in message["parts"])
+            if message["role"] == "user":
+                turns.append(text)
+                expected.append(None)
+            elif turns and expected[-1] is None:
+                expected[-1] = text
+        return Conversation(conversation_id, turns, expected)
+    raise ValueError("expected a `turns` or `messages` list")
+
+
+def parse_conversations(lines: Iterable[str]) -> list[Conversation]:
+    """Parse JSONL conversations; raises ValueError naming the first bad line."""
+    conversations = []
+    seen = set()
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            conversation = parse_conversation(json.loads(line), number)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Line {number}: invalid conversation ({e})") from None
+        if conversation.id in seen:
+            raise ValueError(f"Line {number}: duplicate conversation id {conversation.id!r}")
+        seen.add(conversation.id)
+        conversations.append(conversation)
+    return conversations
+
+
+def prepare_output(path: str) -> set[str]:
+    """Return the ids of conversations already finished in `path`, for resuming a run.
+
+    Lines of unfinished conversations (and a line cut short by the
+    interruption) are removed from the file so they can be replayed cleanly.
+    """
+    if not os.path.exists(path):
+        return set()
+    records = []
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    finished = {r["conversation"] for r in records if r.get("done")}
+    kept = [r for r in records if r.get("conversation") in finished]
+    if len(kept) < len(lines) or (lines and not lines[-1].endswith("\n")):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r) + "\n" for r in kept)
+        os.replace(path + ".tmp", path)
+    return finished
+
+
+class Replayer:
+    """Replays conversations against the model path with isolated histories.
+
+    Uses the given prompt cache, call guard and history compactor (its token
+    budget and summarizer; its session store is not touched), so a replay sees
+    the same prompt, retries and history window as live traffic. Summaries are
+    awaited between turns, as if the background task finished before the guest
+    replied, which keeps replays deterministic.
+    """
+
+    def __init__(self, prompt_cache, guard, compactor, fast_path=None, record_usage=None):
+        self.prompt_cache = prompt_cache
+        self.guard = guard
+        self.compactor = compactor
+        self.fast_path = fast_path
+        # Returns a response's token counts; defaults to the prompt cache's counters
+        self.record_usage = record_usage or prompt_cache.record_usage
+
+    async def run(self, conversations: Iterable[Conversation], workers: int = 4) -> AsyncIterator[dict]:
+        """Replay `conversations` with up to `workers` at a time, yielding records as turns finish."""
+        pending = iter(conversations)
+        records: asyncio.Queue = asyncio.Queue(maxsize=workers * 4)
+
+        async def worker():
+            for conversation in pending:
+                await self.replay(conversation, records.put)
+
+        async def supervise():
+            try:
+                await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+            finally:
+                await records.put(None)
+
+        supervisor = asyncio.create_task(supervise())
+        try:
+            while (record := await records.get()) is not None:
+                yield record
+            await supervisor
+        finally:
+            # The consumer went away (e.g. client disconnected): stop replaying
+            supervisor.cancel()
+
+    async def replay(self, conversation: Conversation, emit) -> None:
+        """Replay one conversation, awaiting `emit(record)` for each turn and the summary."""
+        history: list = []
+        totals = {"prompt_tokens": 0, "cached_prompt_tokens": 0, "uncached_prompt_tokens": 0, "output_tokens": 0}
+        paths: dict[str, int] = {}
+        errors = summaries = 0
+        started = time.perf_counter()
+
+        for index, message in enumerate(conversation.turns):
+            record, history, summarized = await self._turn(history, message)
+            record = {"conversation": conversation.id, "turn": index + 1, **record}
+            if index < len(conversation.expected) and conversation.expected[index] is not None:
+                record["expected"] = conversation.expected[index]
+            for kind, count in record.get("tokens", {}).items():
+                totals[kind] += count
+            paths[record["path"]] = paths.get(record["path"], 0) + 1
+            errors += record["path"] == "error"
+            summaries += summarized
+            await emit(record)
+
+        await emit({
+            "conversation": conversation.id,
+            "done": True,
+            "turns": len(conversation.turns),
+            "errors": errors,
+            "paths": paths,
+            "summaries": summaries,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "tokens": totals,
+        })
+
+    async def _turn(self, history: list, message: str) -> tuple[dict, list, bool]:
+        """Answer one message; return (turn record, updated history, whether a summary was made)."""
+        started = time.perf_counter()
+        window, overflow = self.compactor.fit(history + [{"role": "user", "parts": [message]}])
+        record = {"message": message, "history_tokens": history_tokens(window)}
+
+        reply = self.fast_path.answer(message, first_turn=len(window) == 1) if self.fast_path is not None else None
+        if reply is not None:
+            record.update(reply=reply, path="fast_path")
+        else:
+            try:
+                model = await self.prompt_cache.model()
+                chat = model.start_chat(history=window[:-1])
+                async with self.guard.slot():
+                    response = await self.guard.call(lambda: chat.send_message_async(message))
+                reply = response.text
+                record.update(reply=reply, path="model", tokens=self.record_usage(response))
+            except Exception as e:
+                # Leave the failed message out of the history so roles keep alternating
+                record.update(reply=None, path="error", error=f"{type(e).__name__}: {e}")
+                record["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                return record, history, False
+        record["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        history = window + [{"role": "model", "parts": [reply]}]
+        if not overflow:
+            return record, history, False
+        summary, rest = split_summary(history)
+        try:
+            summary = await self.compactor.summarize(summary, overflow)
+        except Exception as e:
+            record["summary_error"] = f"{type(e).__name__}: {e}"
+            return record, history, False
+        return record, summary_messages(summary) + rest, True
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1] if len(values) > 1 else values[0]
+
+
+async def remote_records(args, conversations: list[Conversation]) -> AsyncIterator[dict]:
+    """Stream records from a running server's /batch/replay endpoint."""
+    import httpx
+
+    body = "".join(
+        json.dumps({"id": c.id, "turns": [{"message": t, "expected": e} for t, e in zip(c.turns, c.expected)]}) + "\n" for c in conversations)
+    headers = {"Content-Type": "application/x-ndjson"}
+    if args.token:
+        headers["Authorization"] = f"Bearer {args.token}"
+    async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+        async with client.stream("POST", "/batch/replay", params={"workers": args.workers},
+                                 content=body, headers=headers) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise SystemExit(f"{args.url}/batch/replay: {response.status_code} {response.text}")
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+def local_records(args, conversations: list[Conversation]) -> AsyncIterator[dict]:
+    """Replay in this process against Gemini, or the local fake with --fake."""
+    if args.fake:
+        os.environ.setdefault("GEMINI_API_KEY", "replay-fake-key")
+        os.environ.setdefault("PROMPT_CACHE", "0")
+    import main
+    from catalog import Catalog, FastPathEngine
+    from llm import PromptCache
+
+    if args.fake:
+        import fake_genai
+        fake_genai.configure(seed=args.seed, latency=args.latency, tokens=args.tokens, error_rate=args.error_rate)
+        fake_genai.install(main.genai)
+    elif not os.getenv("GEMINI_API_KEY"):
+        raise SystemExit("GEMINI_API_KEY is not set (use --fake to replay against the local fake model)")
+
+    prompt = main.SYSTEM_PROMPT
+    if args.prompt:
+        with open(args.prompt, encoding="utf-8") as f:
+            prompt = f.read()
+    prompt_cache = PromptCache(main.MODEL_NAME, prompt, enabled=main.prompt_cache.enabled and not args.fake,
+                               ttl_seconds=main.prompt_cache.ttl_seconds)
+    fast_path = None
+    if main.fast_path is not None and not args.no_fast_path:
+        fast_path = FastPathEngine(Catalog.from_prompt(prompt))
+    replayer = Replayer(prompt_cache, main.model_guard, main.history_compactor, fast_path=fast_path)
+    return replayer.run(conversations, workers=args.workers)
+
+
+async def run(args) -> int:
+    with open(args.input, encoding="utf-8") as f:
+        conversations = parse_conversations(f)
+    finished = prepare_output(args.output) if args.output else set()
+    todo = [c for c in conversations if c.id not in finished]
+    print(f"{len(conversations)} conversations, {len(finished)} already done, replaying {len(todo)} "
+          f"with {args.workers} workers", file=sys.stderr)
+
+    records = remote_records(args, todo) if args.url else local_records(args, todo)
+    out = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    latencies: list[float] = []
+    errors = done = 0
+    tokens: dict[str, int] = {}
+    started = time.perf_counter()
+    try:
+        async for record in records:
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            if record.get("done"):
+                done += 1
+                for kind, count in record["tokens"].items():
+                    tokens[kind] = tokens.get(kind, 0) + count
+                print(f"[{done}/{len(todo)}] {record['conversation']}: {record['turns']} turns, "
+                      f"{record['errors']} errors, {record['latency_ms']:.0f} ms", file=sys.stderr)
+            else:
+                latencies.append(record["latency_ms"])
+                errors += record["path"] == "error"
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    error_rate = errors / len(latencies) if latencies else 0.0
+    print(f"{len(latencies)} turns in {elapsed:.1f}s, {errors} errors ({error_rate:.1%}); "
+          f"turn latency p50 {percentile(latencies, 50):.0f} ms, p95 {percentile(latencies, 95):.0f} ms; "
+          f"tokens {tokens}", file=sys.stderr)
+    if args.max_error_rate is not None and error_rate > args.max_error_rate:
+        print(f"FAIL: error rate {error_rate:.1%} > {args.max_error_rate:.1%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of conversations")
+    parser.add_argument("-o", "--output", help="JSONL results file, appended to and resumed (default: stdout)")
+    parser.add_argument("--workers", type=int, default=4, help="conversations replayed at the same time")
+    parser.add_argument("--prompt", help="file with a system prompt to replay instead of the built-in one")
+    parser.add_argument("--no-fast-path", action="store_true", help="send every turn to the model")
+    parser.add_argument("--url", help="replay on a running server's /batch/replay instead of in this process")
+    parser.add_argument("--token", default=os.getenv("BATCH_API_TOKEN"),
+                        help="bearer token for --url (default: $BATCH_API_TOKEN)")
+    parser.add_argument("--fake", action="store_true", help="replay against the local fake model (fake_genai.py)")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency in seconds")
+    parser.add_argument("--tokens", type=int, default=1, help="tokens per fake reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake model calls that fail")
+    parser.add_argument("--seed", type=int, default=0, help="seed for fake error injection")
+    parser.add_argument("--max-error-rate", type=float, default=None,
+                        help="exit with status 1 if more than this share of turns failed")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args())))
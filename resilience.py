@@ -0,0 +1,256 @@
+"""
+Guarded Gemini calls: deadlines, retries, concurrency limits and a circuit breaker.
+
+Every model call goes through one `ModelCallGuard`:
+
+    async with model_guard.slot(session_id):
+        response = await model_guard.call(lambda: chat.send_message_async(message))
+
+`slot` bounds how many calls run at once (globally and per session) and how
+many may queue for a free slot; anything beyond that is rejected at once with
+`Overloaded` instead of piling up. `call` gives each attempt a timeout, retries
+rate-limit and unavailable errors with jittered exponential backoff until the
+call's overall deadline, and feeds a circuit breaker. While the breaker is open
+`slot` fails fast with `CircuitOpen`, so callers can serve a degraded reply
+instead of waiting on an unhealthy upstream.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses of upstream overload or outage (google.api_core exceptions carry theirs as
+# `code`): worth retrying, and counted by the circuit breaker. Matching on the status rather
+# than the exception classes keeps grpc and protobuf out of the import until the SDK loads.
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 503, 504})
+
+
+def is_retryable(e: BaseException) -> bool:
+    """Whether `e` is an upstream timeout, rate limit or outage (429, 500, 503, 504)."""
+    return isinstance(e, asyncio.TimeoutError) or getattr(e, "code", None) in RETRYABLE_STATUS_CODES
+
+
+class ModelUnavailable(Exception):
+    """The model call was not made or did not succeed; serve a fallback instead."""
+
+
+class Overloaded(ModelUnavailable):
+    """Too many calls in flight or queued (globally or for the session)."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(ModelUnavailable):
+    """Recent calls kept failing; calls are skipped until the breaker's cool-down ends."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive upstream failures.
+
+    After `reset_seconds` one probe call is let through (half-open): success
+    closes the breaker, failure opens it for another `reset_seconds`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+        self.opens = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() >= self.opened_at + self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a call may start now; claims the probe when half-open."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            if self.opened_at is None:
+                self.opens += 1
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release(self) -> None:
+        """Give up a claimed probe without a verdict (e.g. the request was cancelled)."""
+        self.probing = False
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+
+class ModelCallGuard:
+    """Concurrency limits, deadlines, retries and circuit breaking for model calls."""
+
+    def __init__(
+        self,
+        max_concurrent: int = 32,
+        max_queued: int = 64,
+        queue_timeout: float = 10,
+        max_per_session: int = 2,
+        attempt_timeout: float = 20,
+        deadline: float = 40,
+        retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 4,
+        breaker: CircuitBreaker | None = None,
+        events=None,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.max_per_session = max_per_session
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        # Optional metrics.Counter with an `event` label, mirrored from self.counters
+        self.events = events
+
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._queued = 0
+        self._in_flight = 0
+        self._per_session: defaultdict[str, int] = defaultdict(int)
+        self.counters = {
+            "calls": 0, "retries": 0, "timeouts": 0, "failures": 0,
+            "rejected_overloaded": 0, "rejected_session": 0, "rejected_circuit_open": 0,
+        }
+
+    @asynccontextmanager
+    async def slot(self, session_id: str | None = None):
+        """Hold one model-call slot for the block, queueing briefly if all are busy.
+
+        Raises CircuitOpen or Overloaded without waiting when the call should
+        not be attempted.
+        """
+        if not self.breaker.allow():
+            self._count("rejected_circuit_open")
+            raise CircuitOpen("Model calls are paused after repeated failures")
+        claimed_probe = self.breaker.probing
+        session_counted = False
+        try:
+            if session_id is not None and self._per_session[session_id] >= self.max_per_session:
+                self._count("rejected_session")
+                raise Overloaded("Still answering this session's previous messages", retry_after=1)
+            if self._slots.locked() and self._queued >= self.max_queued:
+                self._count("rejected_overloaded")
+                raise Overloaded("Too many model calls queued", retry_after=1)
+
+            if session_id is not None:
+                self._per_session[session_id] += 1
+                session_counted = True
+            self._queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._count("rejected_overloaded")
+                raise Overloaded("Timed out waiting for a model call slot", retry_after=self.queue_timeout)
+            finally:
+                self._queued -= 1
+
+            self._in_flight += 1
+            try:
+                yield
+            finally:
+                self._in_flight -= 1
+                self._slots.release()
+        finally:
+            if session_counted:
+                self._per_session[session_id] -= 1
+                if not self._per_session[session_id]:
+                    del self._per_session[session_id]
+            if claimed_probe and self.breaker.probing:
+                self.breaker.release()
+
+    async def call(self, make_call):
+        """Await `make_call()` with per-attempt timeouts and retries, within the overall deadline.
+
+        `make_call` must start a new request each time it is called.
+        """
+        self._count("calls")
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                result = await asyncio.wait_for(make_call(), min(self.attempt_timeout, remaining))
+            except Exception as e:
+                if not is_retryable(e):
+                    # The upstream answered (e.g. invalid request): not an outage
+                    self.breaker.record_success()
+                    self._count("failures")
+                    raise
+                self.breaker.record_failure()
+                if isinstance(e, asyncio.TimeoutError):
+                    self._count("timeouts")
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if attempt >= self.retries or self.breaker.state != "closed" or \
+                        time.monotonic() + delay >= deadline:
+                    self._count("failures")
+                    raise
+                logger.info("Retrying model call in %.2fs after %s", delay, type(e).__name__)
+                self._count("retries")
+                attempt += 1
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+    async def iterate(self, response):
+        """Yield a streamed response's chunks, failing if the stream stalls past the attempt timeout."""
+        chunks = response.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), self.attempt_timeout)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                self._count("timeouts")
+                raise
+            yield chunk
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "max_concurrent": self.max_concurrent,
+            "circuit": self.breaker.state,
+            "circuit_opens": self.breaker.opens,
+            "circuit_retry_after": round(self.breaker.retry_after(), 1),
+            **self.counters,
+        }
+
+    def _count(self, event: str) -> None:
+        self.counters[event] += 1
+        if self.events is not None:
+            self.events.inc(event=event)
@@ -0,0 +1,140 @@
+"""
+Cache of model replies to first-turn questions.
+
+Most guests open with the same handful of questions (checkout time, pool
+hours, parking). Replies are keyed on the normalized question plus a hash of
+the system prompt, so editing the prompt invalidates every entry. An optional
+character-trigram index also serves near-identical phrasings.
+"""
+
+import hashlib
+import re
+import time
+from collections import OrderedDict, defaultdict
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ResponseCache:
+    """TTL + LRU cache of replies, with optional trigram-similarity lookup.
+
+    `similarity` is the minimum Jaccard similarity of character trigrams for a
+    fuzzy hit; 0 disables fuzzy matching and only exact (normalized) questions hit.
+    """
+
+    def __init__(self, system_prompt: str, ttl_seconds: float = 3600, max_entries: int = 1000,
+                 similarity: float = 0.0):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity = similarity
+
+        # key -> (stored at, reply, seconds the model took to produce it), oldest first
+        self._entries: OrderedDict[str, tuple[float, str, float]] = OrderedDict()
+        self._grams: dict[str, set[str]] = {}
+        self._index: defaultdict[str, set[str]] = defaultdict(set)
+        self.prompt_hash = ""
+        self.set_prompt(system_prompt)
+
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def set_prompt(self, system_prompt: str) -> None:
+        """Drop all entries if the system prompt has changed."""
+        prompt_hash = hashlib.sha256(system_prompt.encode()).hexdigest()[:16]
+        if prompt_hash != self.prompt_hash:
+            self.clear()
+            self.prompt_hash = prompt_hash
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._grams.clear()
+        self._index.clear()
+
+    def get(self, question: str) -> str | None:
+        """Return a cached reply for the question, or None."""
+        text = normalize(question)
+        key = self._key(text)
+        entry = self._live_entry(key)
+        if entry is None and self.similarity > 0:
+            key = self._nearest(text)
+            entry = self._live_entry(key) if key else None
+            if entry is not None:
+                self.fuzzy_hits += 1
+
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += entry[2]
+        return entry[1]
+
+    def put(self, question: str, reply: str, latency: float) -> None:
+        """Store a model reply and how long the model took to produce it."""
+        text = normalize(question)
+        key = self._key(text)
+        self._remove(key)
+        self._entries[key] = (time.monotonic(), reply, latency)
+        if self.similarity > 0:
+            grams = trigrams(text)
+            self._grams[key] = grams
+            for gram in grams:
+                self._index[gram].add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "prompt_hash": self.prompt_hash,
+        }
+
+    def _key(self, text: str) -> str:
+        return f"{self.prompt_hash}:{text}"
+
+    def _live_entry(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+            self._remove(key)
+            return None
+        return entry
+
+    def _nearest(self, text: str) -> str | None:
+        """Key of the most similar cached question by trigram Jaccard similarity, if above the threshold."""
+        grams = trigrams(text)
+        shared: defaultdict[str, int] = defaultdict(int)
+        for gram in grams:
+            for candidate in self._index.get(gram, ()):
+                shared[candidate] += 1
+
+        best, best_score = None, self.similarity
+        for candidate, count in shared.items():
+            score = count / (len(grams) + len(self._grams[candidate]) - count)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _remove(self, key: str) -> None:
+        if self._entries.pop(key, None) is None:
+            return
+        for gram in self._grams.pop(key, ()):
+            keys = self._index[gram]
+            keys.discard(key)
+            if not keys:
+                del self._index[gram]
@@ -0,0 +1,389 @@
+"""
+Conversation history storage with bounded memory use.
+
+Sessions expire after an idle TTL, the least recently used session is evicted
+once the store is full, and each session's history is trimmed to a byte budget
+(and optionally a message count).
+
+Backends:
+- memory: process-local, for a single worker
+- sqlite: a WAL-mode database file shared by all workers on one host
+- redis: a Redis server shared by any number of hosts (pip install redis)
+
+Each /chat turn costs one `load` and one `save`.
+
+Every save gets a new version. A turn that passes the version it loaded to
+`save` fails with SessionConflict if another worker saved the session in the
+meantime, instead of overwriting that worker's turn.
+"""
+
+import asyncio
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Rough per-message overhead (dict, list, role string) on top of the text bytes
+MESSAGE_OVERHEAD_BYTES = 64
+
+
+class SessionConflict(Exception):
+    """The session was saved elsewhere since the version passed to `save` was loaded."""
+
+
+def new_version() -> str:
+    return secrets.token_hex(8)
+
+
+def message_bytes(message: dict) -> int:
+    """Approximate memory held by one {"role", "parts"} history entry."""
+    return MESSAGE_OVERHEAD_BYTES + sum(len(str(part).encode()) for part in message["parts"])
+
+
+class SessionStore:
+    """Base class holding the trim and eviction policy shared by all backends."""
+
+    def __init__(
+        self,
+        ttl_seconds: float = 3600,
+        max_sessions: int = 10000,
+        max_messages: int | None = None,
+        max_bytes: int = 64 * 1024,
+        pinned=None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        # pinned(history) -> how many leading messages trims must keep (e.g. a summary pair)
+        self.pinned = pinned
+
+        # Counted per worker process
+        self.evictions = {"ttl": 0, "lru": 0}
+        self.trimmed_messages = 0
+
+    def trim(self, history: list) -> list:
+        """Drop the oldest messages until the history fits the byte (and count) budgets.
+
+        Pinned leading messages are always kept (and not counted against
+        `max_messages`), and the cut falls before a user message, so the most
+        recent turn is kept whole and roles keep alternating.
+        """
+        pinned = self.pinned(history) if self.pinned else 0
+        head, rest = history[:pinned], history[pinned:]
+        sizes = [message_bytes(m) for m in rest]
+        start = max(0, len(rest) - self.max_messages) if self.max_messages else 0
+        total = sum(message_bytes(m) for m in head) + sum(sizes[start:])
+        while start < len(rest) - 1 and total > self.max_bytes:
+            total -= sizes[start]
+            start += 1
+        # Cut before a user message, keeping at least the latest turn
+        last_turn = max((i for i, m in enumerate(rest) if m["role"] == "user"), default=0)
+        start = min(start, last_turn)
+        while start < last_turn and rest[start]["role"] != "user":
+            start += 1
+        self.trimmed_messages += start
+        return head + rest[start:]
+
+    async def load(self, session_id: str) -> list:
+        """Return a copy of the session's history (empty for unknown sessions)."""
+        return (await self.load_versioned(session_id))[0]
+
+    async def load_versioned(self, session_id: str) -> tuple[list, str]:
+        """Like `load`, plus the session's version to pass to `save` ("" for unknown sessions)."""
+        raise NotImplementedError
+
+    async def save(self, session_id: str, history: list, version: str | None = None) -> None:
+        """Store the session's history, applying the trim and eviction policy.
+
+        With `version`, raise SessionConflict and store nothing if the session
+        is no longer at that version.
+        """
+        raise NotImplementedError
+
+    async def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    async def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Process-local store; history is lost on restart and not shared between workers."""
+
+    def __init__(self, **policy):
+        super().__init__(**policy)
+        # session_id -> (last access time, history, approximate bytes, version), oldest first
+        self._sessions: OrderedDict[str, tuple[float, list, int, str]] = OrderedDict()
+        self._bytes = 0
+
+    async def load_versioned(self, session_id: str) -> tuple[list, str]:
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return [], ""
+        _, history, size, version = entry
+        self._sessions[session_id] = (now, history, size, version)
+        self._sessions.move_to_end(session_id)
+        return list(history), version
+
+    async def save(self, session_id: str, history: list, version: str | None = None) -> None:
+        now = time.monotonic()
+        self._expire(now)
+        if version is not None and self._sessions.get(session_id, (0, [], 0, ""))[3] != version:
+            raise SessionConflict(session_id)
+        history = self.trim(history)
+        size = sum(message_bytes(m) for m in history)
+
+        self._remove(session_id)
+        self._sessions[session_id] = (now, history, size, new_version())
+        self._bytes += size
+
+        self._expire(now)
+        while len(self._sessions) > self.max_sessions:
+            self._pop_oldest("lru")
+
+    async def delete(self, session_id: str) -> None:
+        self._remove(session_id)
+
+    async def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "live_sessions": len(self._sessions),
+            "approx_bytes": self._bytes,
+            "evictions": dict(self.evictions),
+            "trimmed_messages": self.trimmed_messages,
+        }
+
+    def _remove(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _expire(self, now: float) -> None:
+        # Entries are ordered by last access, so stop at the first one still live
+        while self._sessions:
+            last_access = next(iter(self._sessions.values()))[0]
+            if now - last_access <= self.ttl_seconds:
+                break
+            self._pop_oldest("ttl")
+
+    def _pop_oldest(self, reason: str) -> None:
+        _, (_, _, size, _) = self._sessions.popitem(last=False)
+        self._bytes -= size
+        self.evictions[reason] += 1
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store backed by a WAL-mode SQLite file, safe to share between worker processes."""
+
+    def __init__(self, path: str = "sessions.db", **policy):
+        super().__init__(**policy)
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, history TEXT NOT NULL, bytes INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(sessions)")}
+            if "version" not in columns:
+                self._db.execute("ALTER TABLE sessions ADD COLUMN version TEXT NOT NULL DEFAULT ''")
+
+    async def load_versioned(self, session_id: str) -> tuple[list, str]:
+        return await asyncio.to_thread(self._load, session_id)
+
+    async def save(self, session_id: str, history: list, version: str | None = None) -> None:
+        history = self.trim(history)
+        await asyncio.to_thread(self._save, session_id, history, version)
+
+    async def delete(self, session_id: str) -> None:
+        await asyncio.to_thread(self._execute, "DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    async def stats(self) -> dict:
+        count, total = await asyncio.to_thread(
+            lambda: self._execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM sessions").fetchone()
+        )
+        return {
+            "backend": "sqlite",
+            "live_sessions": count,
+            "approx_bytes": total,
+            "evictions": dict(self.evictions),
+            "trimmed_messages": self.trimmed_messages,
+        }
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._db.execute(sql, params)
+
+    def _load(self, session_id: str) -> tuple[list, str]:
+        now = time.time()
+        with self._lock:
+            # Touch and read in one statement so a load costs a single write transaction
+            row = self._db.execute(
+                "UPDATE sessions SET last_access = ? WHERE id = ? AND last_access >= ? RETURNING history, version",
+                (now, session_id, now - self.ttl_seconds),
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else ([], "")
+
+    def _save(self, session_id: str, history: list, version: str | None) -> None:
+        now = time.time()
+        size = sum(message_bytes(m) for m in history)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if version is not None:
+                    row = self._db.execute(
+                        "SELECT version FROM sessions WHERE id = ? AND last_access >= ?",
+                        (session_id, now - self.ttl_seconds),
+                    ).fetchone()
+                    if (row[0] if row else "") != version:
+                        raise SessionConflict(session_id)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions (id, history, bytes, last_access, version) VALUES (?, ?, ?, ?, ?)",
+                    (session_id, json.dumps(history), size, now, new_version()),
+                )
+                expired = self._db.execute(
+                    "DELETE FROM sessions WHERE last_access < ?", (now - self.ttl_seconds,)
+                ).rowcount
+                (count,) = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+                evicted = 0
+                if count > self.max_sessions:
+                    evicted = self._db.execute(
+                        "DELETE FROM sessions WHERE id IN "
+                        "(SELECT id FROM sessions ORDER BY last_access LIMIT ?)",
+                        (count - self.max_sessions,),
+                    ).rowcount
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        self.evictions["ttl"] += expired
+        self.evictions["lru"] += evicted
+
+
+class RedisSessionStore(SessionStore):
+    """Store backed by Redis, shared by any number of workers and hosts.
+
+    Each history is a JSON string key (with its version) and the idle TTL as
+    its expiry. A sorted set of last-access times drives LRU eviction and a
+    hash tracks sizes. Versioned saves use WATCH/MULTI on the history key.
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "chat:", client=None, **policy):
+        super().__init__(**policy)
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as e:
+                raise RuntimeError("SESSION_BACKEND=redis requires the redis package (pip install redis)") from e
+            client = redis.from_url(url)
+        try:
+            from redis.exceptions import WatchError
+        except ImportError:  # an injected client without the redis package never raises it
+            WatchError = SessionConflict
+        self._watch_error = WatchError
+        self._redis = client
+        self._prefix = prefix
+        self._lru_key = prefix + "__lru"
+        self._bytes_key = prefix + "__bytes"
+
+    def _key(self, session_id: str) -> str:
+        return self._prefix + session_id
+
+    async def load_versioned(self, session_id: str) -> tuple[list, str]:
+        key = self._key(session_id)
+        ttl = max(1, int(self.ttl_seconds))
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.expire(key, ttl)
+            pipe.zadd(self._lru_key, {session_id: time.time()}, xx=True, ch=True)
+            data, _, indexed = await pipe.execute()
+        if data is None and indexed:
+            # The history key expired but the index still had it: drop it, or the touch above keeps it live
+            await self._remove([session_id])
+            self.evictions["ttl"] += 1
+        return self._decode(data)
+
+    @staticmethod
+    def _decode(data) -> tuple[list, str]:
+        if not data:
+            return [], ""
+        value = json.loads(data)
+        if isinstance(value, list):
+            return value, ""  # stored before sessions had versions
+        return value["history"], value["version"]
+
+    async def save(self, session_id: str, history: list, version: str | None = None) -> None:
+        history = self.trim(history)
+        now = time.time()
+        size = sum(message_bytes(m) for m in history)
+        key = self._key(session_id)
+        async with self._redis.pipeline(transaction=version is not None) as pipe:
+            if version is not None:
+                await pipe.watch(key)
+                if self._decode(await pipe.get(key))[1] != version:
+                    raise SessionConflict(session_id)
+                pipe.multi()
+            pipe.set(key, json.dumps({"version": new_version(), "history": history}),
+                     ex=max(1, int(self.ttl_seconds)))
+            pipe.zadd(self._lru_key, {session_id: now})
+            pipe.hset(self._bytes_key, session_id, size)
+            pipe.zrangebyscore(self._lru_key, "-inf", now - self.ttl_seconds)
+            pipe.zcard(self._lru_key)
+            try:
+                _, _, _, expired, count = await pipe.execute()
+            except self._watch_error as e:
+                raise SessionConflict(session_id) from e
+
+        # History keys expire on their own; drop their index entries
+        if expired:
+            await self._remove([s.decode() if isinstance(s, bytes) else s for s in expired])
+            self.evictions["ttl"] += len(expired)
+            count -= len(expired)
+        if count > self.max_sessions:
+            oldest = await self._redis.zrange(self._lru_key, 0, count - self.max_sessions - 1)
+            await self._remove([s.decode() if isinstance(s, bytes) else s for s in oldest])
+            self.evictions["lru"] += len(oldest)
+
+    async def delete(self, session_id: str) -> None:
+        await self._remove([session_id])
+
+    async def stats(self) -> dict:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.zcard(self._lru_key)
+            pipe.hvals(self._bytes_key)
+            count, sizes = await pipe.execute()
+        return {
+            "backend": "redis",
+            "live_sessions": count,
+            "approx_bytes": sum(int(s) for s in sizes),
+            "evictions": dict(self.evictions),
+            "trimmed_messages": self.trimmed_messages,
+        }
+
+    async def _remove(self, session_ids: list[str]) -> None:
+        if not session_ids:
+            return
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.delete(*(self._key(s) for s in session_ids))
+            pipe.zrem(self._lru_key, *session_ids)
+            pipe.hdel(self._bytes_key, *session_ids)
+            await pipe.execute()
+
+
+def create_session_store(backend: str = "memory", **options) -> SessionStore:
+    """Build the session store named by `backend` (memory, sqlite or redis)."""
+    if backend == "memory":
+        return MemorySessionStore(**options)
+    if backend == "sqlite":
+        return SQLiteSessionStore(**options)
+    if backend == "redis":
+        return RedisSessionStore(**options)
+    raise ValueError(f"Unknown session backend: {backend!r}")
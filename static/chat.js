@@ -0,0 +1,135 @@
+const sessionId = 'session_' + Math.random().toString(36).substr(2, 9);
+const chatMessages = document.getElementById('chatMessages');
+const chatInput = document.getElementById('chatInput');
+const sendBtn = document.getElementById('sendBtn');
+
+function addMessage(content, isUser = false) {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${isUser ? 'user' : 'bot'}`;
+    messageDiv.textContent = content;
+    chatMessages.appendChild(messageDiv);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+    return messageDiv;
+}
+
+function parseEvent(raw) {
+    const evt = { event: 'message', data: '' };
+    for (const line of raw.split('\n')) {
+        if (line.startsWith('event: ')) evt.event = line.slice(7);
+        else if (line.startsWith('data: ')) evt.data += line.slice(6);
+    }
+    evt.data = evt.data ? JSON.parse(evt.data) : {};
+    return evt;
+}
+
+async function readStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let botDiv = null;
+    let text = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line; keep any partial event in the buffer
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const raw of events) {
+            const evt = parseEvent(raw);
+            if (evt.event === 'error') {
+                hideTyping();
+                addMessage('Sorry, there was an error: ' + (evt.data.detail || 'Please try again.'));
+            } else if (evt.event === 'message') {
+                if (!botDiv) {
+                    hideTyping();
+                    botDiv = addMessage('');
+                }
+                text += evt.data.text;
+                botDiv.textContent = text;
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            }
+        }
+    }
+    hideTyping();
+}
+
+function showTyping() {
+    const typingDiv = document.createElement('div');
+    typingDiv.className = 'message bot typing';
+    typingDiv.id = 'typingIndicator';
+    typingDiv.innerHTML = `
+        <div class="typing-indicator">
+            <span></span>
+            <span></span>
+            <span></span>
+        </div>
+    `;
+    chatMessages.appendChild(typingDiv);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
+function hideTyping() {
+    const typing = document.getElementById('typingIndicator');
+    if (typing) typing.remove();
+}
+
+async function sendMessage() {
+    const message = chatInput.value.trim();
+    if (!message) return;
+
+    addMessage(message, true);
+    chatInput.value = '';
+    sendBtn.disabled = true;
+    showTyping();
+
+    try {
+        const response = await fetch('/chat/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ message, session_id: sessionId })
+        });
+
+        if (!response.ok) {
+            hideTyping();
+            const error = await response.json();
+            addMessage('Sorry, there was an error: ' + (error.detail || 'Please try again.'));
+        } else {
+            await readStream(response);
+        }
+    } catch (error) {
+        hideTyping();
+        addMessage('Sorry, I couldn\'t connect to the server. Please make sure it\'s running.');
+    }
+
+    sendBtn.disabled = false;
+    chatInput.focus();
+}
+
+function sendQuickMessage(message) {
+    chatInput.value = message;
+    sendMessage();
+}
+
+function handleKeyPress(event) {
+    if (event.key === 'Enter') {
+        sendMessage();
+    }
+}
+
+async function resetChat() {
+    try {
+        await fetch(`/reset?session_id=${sessionId}`, { method: 'POST' });
+    } catch (e) {}
+    
+    chatMessages.innerHTML = `
+        <div class="message bot">
+            Welcome to Seattle Marriott Bellevue! I'm your virtual concierge. How may I assist you today? I can help with check-in, check-out, room service, or answer any questions about our hotel and amenities.
+        </div>
+    `;
+}
+
+chatInput.focus();
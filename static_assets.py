@@ -0,0 +1,150 @@
+"""
+In-memory, precompressed chat UI assets.
+
+The page and its CSS/JS are read once at startup, compressed with gzip (and
+brotli, listed in requirements.txt; without it only gzip is served) and served from memory with
+ETag/Last-Modified validators. The page links its CSS/JS under names that
+include a content hash, so those can be cached for a year and a deploy that
+changes them is picked up at the next page load. The page itself is
+revalidated on every load, which is a 304 with no body when nothing changed.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import re
+from dataclasses import dataclass, field
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # e.g. a trimmed install: gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Responses smaller than this aren't worth compressing
+MIN_COMPRESS_BYTES = 512
+
+
+@dataclass
+class Asset:
+    content_type: str
+    body: bytes
+    modified: float
+    cache_control: str
+    etag: str = ""
+    # content-coding ("br", "gzip") -> compressed body, only when smaller
+    encoded: dict[str, bytes] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.etag = hashlib.sha256(self.body).hexdigest()[:16]
+        if len(self.body) < MIN_COMPRESS_BYTES:
+            return
+        candidates = {"gzip": gzip.compress(self.body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            candidates["br"] = brotli.compress(self.body, quality=11)
+        self.encoded = {coding: data for coding, data in candidates.items() if len(data) < len(self.body)}
+
+
+def accepted_codings(header: str) -> set[str]:
+    """Content codings the client accepts (q > 0) from an Accept-Encoding header."""
+    codings = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = re.search(r"q\s*=\s*([\d.]+)", params)
+        if name and (q is None or float(q.group(1)) > 0):
+            codings.add(name.strip().lower())
+    return codings
+
+
+class StaticAssets:
+    """The chat page plus the files in `static/`, served from memory.
+
+    Each file in `static/` is available under its own name (revalidated) and
+    under a hashed name like `chat.3f2a9c1b.css` (cached for a year); links
+    to `/static/<name>` in the page are rewritten to the hashed name.
+    """
+
+    def __init__(self, directory: Path, page: str = "index.html"):
+        self.directory = Path(directory)
+        self.page = page
+        self._assets: dict[str, Asset] = {}
+        self.load()
+
+    def load(self) -> None:
+        assets: dict[str, Asset] = {}
+        hashed_names: dict[str, str] = {}
+        for path in sorted((self.directory / "static").glob("*")):
+            if not path.is_file():
+                continue
+            body = path.read_bytes()
+            content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type.endswith("javascript"):
+                content_type += "; charset=utf-8"
+            modified = path.stat().st_mtime
+            assets[path.name] = asset = Asset(content_type, body, modified, REVALIDATE)
+            hashed = f"{path.stem}.{asset.etag[:8]}{path.suffix}"
+            assets[hashed] = Asset(content_type, body, modified, IMMUTABLE)
+            hashed_names[path.name] = hashed
+
+        page_path = self.directory / self.page
+        html = page_path.read_text(encoding="utf-8")
+        html = re.sub(
+            r"/static/([\w.-]+)",
+            lambda m: f"/static/{hashed_names.get(m.group(1), m.group(1))}",
+            html,
+        )
+        modified = max([page_path.stat().st_mtime] + [a.modified for a in assets.values()])
+        assets[self.page] = Asset("text/html; charset=utf-8", html.encode(), modified, REVALIDATE)
+
+        self._assets = assets
+        page = assets[self.page]
+        logger.info("Loaded %d UI assets; page %d bytes, %s", len(hashed_names) + 1, len(page.body),
+                    ", ".join(f"{coding} {len(data)}" for coding, data in page.encoded.items()) or "uncompressed")
+
+    def response(self, name: str, request: Request) -> Response | None:
+        """The asset as a 200 (in the best encoding the client accepts) or 304; None if unknown."""
+        asset = self._assets.get(name)
+        if asset is None:
+            return None
+
+        accepted = accepted_codings(request.headers.get("accept-encoding", ""))
+        coding = next((c for c in ("br", "gzip") if c in accepted and c in asset.encoded), None)
+        # Each encoding is a different byte sequence, so it gets its own strong validator
+        etag = f'"{asset.etag}-{coding}"' if coding else f'"{asset.etag}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(asset.modified, usegmt=True),
+            "Cache-Control": asset.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+
+        if self._not_modified(request, asset, etag):
+            return Response(status_code=304, headers=headers)
+        if coding:
+            headers["Content-Encoding"] = coding
+        return Response(asset.encoded.get(coding, asset.body), media_type=asset.content_type, headers=headers)
+
+    @staticmethod
+    def _not_modified(request: Request, asset: Asset, etag: str) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            # Weak comparison, as RFC 9110 requires for If-None-Match
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return "*" in tags or etag in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(asset.modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
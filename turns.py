@@ -0,0 +1,150 @@
+"""
+Ordering and de-duplication of chat turns.
+
+A session's turns run one at a time, in arrival order, so two tabs sharing a
+session or a double-clicked send can't interleave their messages and replies
+in the history. A message that repeats one still being answered for the same
+session, or answered within the last few seconds, shares that reply instead of
+starting another model call.
+
+Both hold within one worker process. Across workers sharing a session store,
+turns of one session can run concurrently; the store's versioned save makes
+the later one append to the history instead of overwriting the earlier one.
+
+    reply = await turns.joined(session_id, message)
+    if reply is None:
+        turn = turns.claim(session_id, message)
+        try:
+            async with turns.serialized(session_id):
+                reply = ...
+                turn.resolve(reply)
+        finally:
+            turn.release()
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from response_cache import normalize
+
+
+class SessionBusy(Exception):
+    """Too many turns already waiting for this session."""
+
+
+class Turn:
+    """A claimed turn; identical messages arriving meanwhile wait for its reply."""
+
+    def __init__(self, coordinator: "TurnCoordinator", key: tuple, future: asyncio.Future):
+        self._coordinator = coordinator
+        self._key = key
+        self._future = future
+
+    def resolve(self, reply: str) -> None:
+        """Share `reply` with the duplicates waiting now and those arriving within the window."""
+        if not self._future.done():
+            self._future.set_result(reply)
+            self._coordinator._remember(self._key, reply)
+
+    def release(self) -> None:
+        """End the claim; waiting duplicates get None and answer the message themselves."""
+        if not self._future.done():
+            self._future.set_result(None)
+        if self._coordinator._in_flight.get(self._key) is self._future:
+            del self._coordinator._in_flight[self._key]
+
+
+class TurnCoordinator:
+    """Per-session turn lock plus sharing of replies between duplicate submissions.
+
+    `dedup_seconds` is how long after a reply an identical message (same
+    session, same normalized text) still gets it; 0 only shares in-flight
+    turns. `max_pending` bounds the turns running or queued per session.
+    """
+
+    def __init__(self, dedup_seconds: float = 2.0, max_pending: int = 4):
+        self.dedup_seconds = dedup_seconds
+        self.max_pending = max_pending
+
+        # session_id -> [lock, turns holding or waiting for it]
+        self._locks: dict[str, list] = {}
+        self._in_flight: dict[tuple, asyncio.Future] = {}
+        # (session_id, normalized message) -> (answered at, reply), oldest first
+        self._recent: OrderedDict[tuple, tuple[float, str]] = OrderedDict()
+
+        self.counters = {"serialized": 0, "deduplicated": 0, "waited": 0, "rejected": 0}
+
+    async def joined(self, session_id: str, message: str) -> str | None:
+        """The reply of an identical turn in flight or just answered, or None to answer it anew."""
+        key = (session_id, normalize(message))
+        self._expire()
+        recent = self._recent.get(key)
+        if recent is not None:
+            self.counters["deduplicated"] += 1
+            return recent[1]
+
+        future = self._in_flight.get(key)
+        if future is None:
+            return None
+        reply = await asyncio.shield(future)
+        if reply is not None:
+            self.counters["deduplicated"] += 1
+        return reply
+
+    def claim(self, session_id: str, message: str) -> Turn:
+        """Register a turn for `message`; call `release` when done, even on failure."""
+        key = (session_id, normalize(message))
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        return Turn(self, key, future)
+
+    @asynccontextmanager
+    async def serialized(self, session_id: str, bounded: bool = True):
+        """Hold the session's turn lock.
+
+        Raises SessionBusy if `max_pending` turns are already running or queued,
+        unless `bounded` is False (resets and background history updates).
+        """
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        if bounded and entry[1] >= self.max_pending:
+            self.counters["rejected"] += 1
+            raise SessionBusy("Still answering this session's previous messages")
+
+        entry[1] += 1
+        if entry[0].locked():
+            self.counters["waited"] += 1
+        try:
+            async with entry[0]:
+                self.counters["serialized"] += 1
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[session_id]
+
+    def forget(self, session_id: str) -> None:
+        """Drop the session's remembered replies (e.g. after a reset)."""
+        for key in [key for key in self._recent if key[0] == session_id]:
+            del self._recent[key]
+
+    def stats(self) -> dict:
+        return {
+            "active_sessions": len(self._locks),
+            "in_flight": len(self._in_flight),
+            "remembered": len(self._recent),
+            **self.counters,
+        }
+
+    def _remember(self, key: tuple, reply: str) -> None:
+        if self.dedup_seconds > 0:
+            self._recent[key] = (time.monotonic(), reply)
+            self._recent.move_to_end(key)
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.dedup_seconds
+        while self._recent and next(iter(self._recent.values()))[0] < cutoff:
+            self._recent.popitem(last=False)